@@ -0,0 +1,149 @@
+"""
+analyse.py
+
+Finds the best move and its value for a list of positions, searching them in parallel and giving the results in input
+order. Each input line is a position, either as text:
+    X.O/.X./..O O 3
+or as JSON:
+    {"board": "X.O/.X./..O", "side": "O", "k": 3}
+Board strings list the squares row by row with '.' for empty and '-' for a block. Rows are separated by '/', the grids
+of a plane by '|' and the planes by ';'. A JSON board may also be given as nested lists like GameState.board.
+Results are written one JSON object per line. Run this file on a file of positions, or '-' for standard input:
+    python3 analyse.py positions.txt --depth 4 --workers 4
+    python3 analyse.py positions.jsonl --max-nodes 100000
+"""
+import argparse
+import collections
+import game
+import json
+import minimax_agent
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+"""Characters of the pieces in a board string"""
+PIECE_CHARS = {'.': game.EMPTY_PIECE, ' ': game.EMPTY_PIECE, game.X_PIECE: game.X_PIECE, game.O_PIECE: game.O_PIECE,
+               game.BLOCK_PIECE: game.BLOCK_PIECE}
+
+"""Agents of a worker process, by board shape, k and piece"""
+_agents = dict()
+
+
+@dataclass
+class Analysis:
+    """
+    Result of analysing a position. value is from the perspective of the player to move, and depth is the deepest
+    search that completed. move and value are None if the budget ran out before depth 1. pv lists the best moves with
+    their values, best first, when more than one was asked for.
+    """
+    move: [tuple, None]
+    value: [float, None]
+    depth: int
+    nodes: int
+    pv: list = None
+
+
+def parse_board(text: str) -> list:
+    """
+    Reads a board string.
+    :param text: board string, rows separated by '/', grids by '|' and planes by ';'
+    :return: board as nested lists like GameState.board
+    """
+    return [[[[PIECE_CHARS[c] for c in row] for row in grid.split('/')] for grid in plane.split('|')]
+            for plane in text.split(';')]
+
+
+def format_board(board: list) -> str:
+    """
+    Writes a board string, the inverse of parse_board().
+    """
+    return ';'.join('|'.join('/'.join(''.join('.' if piece == game.EMPTY_PIECE else piece for piece in row)
+                                      for row in grid) for grid in plane) for plane in board)
+
+
+def parse_position(line: str) -> game.GameState:
+    """
+    Reads a position in text or JSON form.
+    :param line: input line
+    :return: game state
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        position = json.loads(line)
+        board = position['board']
+        board = parse_board(board) if isinstance(board, str) else board
+        return game.GameState(board, position['side'], position['k'])
+    board, side, k = line.split()
+    return game.GameState(parse_board(board), side, int(k))
+
+
+def analyse_position(state: game.GameState, depth: int = None, max_nodes: int = None, multi_pv: int = 1) -> Analysis:
+    """
+    Analyses one position with the agent kept for its board shape, so that the window index, pattern tables and
+    Zobrist table are only built once per shape. Runs in a worker process.
+    :param state: position to analyse
+    :param depth: depth limit. None searches until the node budget runs out
+    :param max_nodes: node budget for each search. None means no limit
+    :param multi_pv: number of best moves to find
+    :return: analysis
+    """
+    key = (tuple(state.d), state.k, state.next_player)
+    if key not in _agents:
+        _agents[key] = minimax_agent.MinimaxAgent(state, state.next_player)
+        _agents[key].silent = True
+        _agents[key].selective_depth = 0
+    a = _agents[key]
+    a.max_depth = depth if depth is not None else len(a.legal_moves(state))
+    a.max_nodes = max_nodes
+    a.multi_pv = multi_pv
+    move = a.choose_move(state, None)
+    if a.search_value is None:
+        move = None
+    return Analysis(move, a.search_value, a.search_depth, a.search_nodes, a.pv_moves if multi_pv > 1 else None)
+
+
+def analyse(positions, depth: int = None, max_nodes: int = None, workers: int = None, backlog: int = 4,
+            multi_pv: int = 1):
+    """
+    Analyses positions on a process pool, yielding the results in the order of the positions as soon as they are ready.
+    Only a few positions per worker are in flight at once, so the positions can come from a stream of any length.
+    :param positions: iterable of game states
+    :param depth: depth limit. None with no node budget searches to depth 3
+    :param max_nodes: node budget for each search. None means no limit
+    :param workers: number of worker processes. None uses every core
+    :param backlog: positions in flight per worker
+    :param multi_pv: number of best moves to find for each position
+    :return: generator of analyses
+    """
+    if depth is None and max_nodes is None:
+        depth = 3
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as pool:
+        in_flight = collections.deque()
+        for state in positions:
+            in_flight.append(pool.submit(analyse_position, state, depth, max_nodes, multi_pv))
+            if len(in_flight) >= backlog * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the best move for each of a list of positions.")
+    parser.add_argument('positions', help="file of positions, one per line, or - for standard input")
+    parser.add_argument('--depth', type=int, default=None, help="search depth limit")
+    parser.add_argument('--max-nodes', type=int, default=None, help="node budget per position")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument('--multi-pv', type=int, default=1, help="number of best moves to list")
+    args = parser.parse_args()
+
+    file = sys.stdin if args.positions == '-' else open(args.positions)
+    with file:
+        states = (parse_position(line) for line in file if line.strip())
+        for result in analyse(states, args.depth, args.max_nodes, args.workers, multi_pv=args.multi_pv):
+            output = {'move': None if result.move is None else list(result.move), 'value': result.value,
+                      'depth': result.depth, 'nodes': result.nodes}
+            if result.pv is not None:
+                output['pv'] = [{'move': list(move), 'value': value} for move, value in result.pv]
+            print(json.dumps(output), flush=True)
@@ -13,16 +13,33 @@ You can also run individual tests from this file. On PyCharm, you can click the
 other platforms, refer to https://docs.python.org/3/library/unittest.html#command-line-interface for info on that.
 """
 
+import asyncio
+import json
 import math
 import numbers
+import numpy as np
+import os
+import random
+import tempfile
 
 import agent
+import analyse
+import cache
+import differential
 import game
 import minimax_agent
+import patterns
+import solver
+import threats
+import windows
+import tune
+import transcript
 
 import unittest
 
 import runner
+import selfplay
+import server
 
 
 class TestAgent(minimax_agent.MinimaxAgent):
@@ -99,6 +116,344 @@ class MinimaxTest(unittest.TestCase):
             self.assertLessEqual(self.a.sef_calls, math.factorial(9) // math.factorial(9-d))
 
 
+class NegamaxTest(unittest.TestCase):
+    def setUp(self):
+        self.s = game.GameState.tic_tac_toe().make_move((0, 0, 0, 1))
+        self.a = TestAgent(initial_state=self.s, piece=game.X_PIECE)
+        self.a.lmr_enabled = False
+
+    def full_width(self, state, depth):
+        """Plain minimax without pruning, scoring wins the same way as the agent"""
+        moves = self.a.legal_moves(state)
+        if depth == 0:
+            return self.a.static_eval(state)
+        if not moves:
+            return 0.0
+        sign = 1 if state.next_player == game.X_PIECE else -1
+        values = []
+        for move in moves:
+            new_state = state.make_move(move)
+            if new_state.winner() == state.next_player:
+                values.append(sign * self.a.win_value(state) * (depth + 1))
+            else:
+                values.append(self.full_width(new_state, depth - 1))
+        return max(values) if sign == 1 else min(values)
+
+    def test_matches_full_width(self):
+        for d in range(1, 5):
+            move, val = self.a.minimax(self.s, depth_remaining=d)
+            self.assertEqual(val, self.full_width(self.s, d), f"Negamax value differs at depth {d}")
+
+    def test_aspiration_matches_full_window(self):
+        z_table = [[random.getrandbits(32) for _ in range(2)] for _ in range(9)]
+        guess = None
+        for d in range(1, 5):
+            move, val = self.a.aspiration_search(self.s, d, guess, None, (z_table, dict(), 0))
+            _, full_val = self.a.negamax(self.s, d, float("-inf"), float("inf"))
+            self.assertEqual(val, full_val, f"Aspiration search value differs at depth {d}")
+            guess = val
+
+    def test_hash_collision(self):
+        """With every key equal, each table entry belongs to some other position"""
+        z_table = [[0, 0] for _ in range(9)]
+        z_memory = {0: (0, 0, (0, 0, 0, 1), 0.0)}
+        move, val = self.a.minimax(self.s, depth_remaining=2, z_hashing=(z_table, z_memory, 0))
+        self.assertTrue(self.s.is_valid_move(move), "Minimax returned a move from a colliding table entry")
+
+    def test_pvs_searches_fewer_nodes(self):
+        self.a.search_nodes = 0
+        self.a.minimax(self.s, depth_remaining=4)
+        pvs_nodes = self.a.search_nodes
+        self.assertLess(pvs_nodes, math.factorial(8) // math.factorial(4))
+
+
+class SelectiveSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.s = game.GameState.no_corners_small()
+        for move in [(0, 0, 2, 2), (0, 0, 1, 1), (0, 0, 2, 1)]:
+            self.s = self.s.make_move(move)
+        self.a = TestAgent(initial_state=self.s, piece=game.O_PIECE)
+
+    def search(self, depth, lmr, futility):
+        self.a.lmr_enabled = lmr
+        self.a.futility_enabled = futility
+        self.a.search_nodes = 0
+        move, val = self.a.minimax(self.s, depth_remaining=depth)
+        return move, val, self.a.search_nodes
+
+    def test_futility_is_exact(self):
+        for d in range(1, 4):
+            _, full_val, full_nodes = self.search(d, False, False)
+            _, val, nodes = self.search(d, False, True)
+            self.assertEqual(val, full_val, f"Futility pruning changed the value at depth {d}")
+            self.assertLessEqual(nodes, full_nodes)
+
+    def test_choose_move_searches_past_depth_3(self):
+        self.a.silent = True
+        move = self.a.choose_move(self.s, None)
+        self.assertTrue(self.s.is_valid_move(move))
+        self.assertGreater(self.a.search_depth, 3, "Selective search did not buy any extra depth")
+
+    def test_lmr_reduces_nodes(self):
+        _, _, full_nodes = self.search(3, False, False)
+        move, _, nodes = self.search(3, True, False)
+        self.assertTrue(self.s.is_valid_move(move))
+        self.assertLess(nodes, full_nodes)
+
+
+class DeterministicTest(unittest.TestCase):
+    def search(self, state, seed=0):
+        a = TestAgent(state, state.next_player)
+        a.silent = True
+        a.seed = seed
+        a.max_nodes = 3000
+        move = a.choose_move(state, None)
+        return move, a.search_value, a.search_depth, a.search_nodes, a.eval_calls, a.lmr_reductions, a.futility_prunes
+
+    def test_same_search_every_time(self):
+        s = game.GameState.no_corners_small().make_move((0, 0, 2, 2))
+        first = self.search(s)
+        self.assertEqual(first[3], 3000)
+        self.assertEqual(self.search(s), first)
+        self.assertEqual(self.search(s, seed=1)[3], 3000)
+
+    def test_seeded_hash_keys(self):
+        s = game.GameState.no_corners_small()
+        self.assertEqual(windows.WindowBoard(s).z_table, windows.WindowBoard(s).z_table)
+        self.assertEqual(windows.zobrist_table(25, 1), windows.zobrist_table(25, 1))
+        self.assertNotEqual(windows.zobrist_table(25, 1), windows.zobrist_table(25, 2))
+
+
+class EvalCacheTest(unittest.TestCase):
+    def test_slots(self):
+        c = cache.EvalCache(bits=4)
+        c.put(3, 1.5)
+        self.assertEqual(c.get(3), 1.5)
+        self.assertIsNone(c.get(3 + 16), "Keys sharing a slot must be told apart")
+        c.put(3 + 16, -2.0)
+        self.assertIsNone(c.get(3))
+        self.assertEqual(c.get(3 + 16), -2.0)
+        self.assertIsNone(c.get(0))
+        self.assertEqual(c.hit_rate(), 2 / 5)
+        self.assertEqual(len(c.keys), 16)
+
+    def test_search_unchanged(self):
+        s = game.GameState.no_corners_small().make_move((0, 0, 2, 2))
+        results = []
+        for enabled in (False, True):
+            a = TestAgent(s, game.O_PIECE)
+            a.silent = True
+            a.eval_cache_enabled = enabled
+            results.append((a.choose_move(s, None), a.search_value, a.search_nodes, a.sef_calls))
+        self.assertEqual(results[0][:3], results[1][:3])
+        self.assertLess(results[1][3], results[0][3])
+
+    def test_kept_across_moves(self):
+        s = game.GameState.no_corners_small().make_move((0, 0, 2, 2))
+        a = TestAgent(s, game.O_PIECE)
+        a.silent = True
+        a.choose_move(s, None)
+        first_calls = a.sef_calls
+        a.sef_calls = 0
+        a.choose_move(s, None)
+        self.assertLess(a.sef_calls, first_calls / 10)
+        self.assertGreater(a.eval_cache.hit_rate(), 0.5)
+
+
+class ReuseTest(unittest.TestCase):
+    def test_new_game_keeps_tables(self):
+        s = game.GameState.no_corners_small().make_move((0, 0, 2, 2))
+        a = TestAgent(s, game.O_PIECE)
+        a.silent = True
+        a.choose_move(s, None)
+        z_table = a.zobrist_table(25)
+        first_calls = a.sef_calls
+        a.sef_calls = 0
+        a.new_game(game.GameState.no_corners_small().make_move((0, 0, 2, 2)))
+        self.assertIsNone(a.search_value)
+        a.choose_move(s, None)
+        self.assertIs(a.zobrist_table(25), z_table)
+        self.assertLess(a.sef_calls, first_calls / 10)
+
+        a.new_game(game.GameState.tic_tac_toe(), game.X_PIECE)
+        self.assertEqual(a.piece, game.X_PIECE)
+        self.assertEqual(a.eval_cache.fill(), 0, "The evaluation cache must be cleared for a different board")
+
+    def test_reused_agents_play_the_same_games(self):
+        s = game.GameState.tic_tac_toe()
+        x, o = selfplay.RecordingAgent(s, game.X_PIECE), selfplay.RecordingAgent(s, game.O_PIECE)
+        r = runner.GameRunner(x, o)
+        for opening in ((0, 0, 1, 1), (0, 0, 0, 0)):
+            start = s.make_move(opening)
+            fresh_x = selfplay.RecordingAgent(start, game.X_PIECE)
+            fresh_o = selfplay.RecordingAgent(start, game.O_PIECE)
+            winner = runner.GameRunner(fresh_x, fresh_o).run_game(start, silent=True)
+            self.assertEqual(r.run_game(start, silent=True), winner)
+            self.assertEqual(x.positions, fresh_x.positions)
+            self.assertEqual(o.positions, fresh_o.positions)
+
+    def test_geometry_file(self):
+        s = game.GameState.empty((1, 1, 5, 6), 4)
+        built = windows.WindowIndex.of(s)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'geometry.pkl')
+            windows.save_geometry(filename, s, seed=3)
+            del windows.WindowIndex._cache[(built.d, built.k)]
+            loaded, seed, z_table = windows.load_geometry(filename)
+            self.assertIsNot(loaded, built)
+            self.assertIs(windows.WindowIndex.of(s), loaded)
+            self.assertEqual(loaded.windows, built.windows)
+            self.assertEqual(loaded.cell_windows, built.cell_windows)
+            self.assertEqual(seed, 3)
+            self.assertEqual(z_table, windows.zobrist_table(30, 3))
+
+            played = s.make_move((0, 0, 1, 1)).make_move((0, 0, 2, 2))
+            self.assertEqual(loaded.winner(loaded.flatten(played)), built.winner(built.flatten(played)))
+
+            a = minimax_agent.MinimaxAgent(s, game.X_PIECE)
+            a.seed = 3
+            self.assertIs(a.load_geometry(filename), loaded)
+            self.assertIn((30, 3), a.z_tables, "The agent must use the loaded Zobrist table")
+            self.assertEqual(a.zobrist_table(30), z_table)
+
+        """A different block layout starts the cache again"""
+        t = game.GameState.empty((1, 1, 5, 5), 4).make_move((0, 0, 2, 2))
+        a.choose_move(t, None)
+        self.assertEqual(a.eval_cache_board[2], ())
+
+
+class LivenessTest(unittest.TestCase):
+    def test_early_draw(self):
+        """Every window holds both players' pieces, although one square is still empty"""
+        s = game.GameState([[[['X', 'O', 'X'], ['X', 'O', 'O'], ['O', 'X', ' ']]]], game.X_PIECE, 3)
+        self.assertEqual(s.winner(), 'draw')
+        s = game.GameState([[[['X', 'O', 'X'], ['X', 'O', 'O'], [' ', 'X', ' ']]]], game.O_PIECE, 3)
+        self.assertIsNone(s.winner())
+
+    def test_blocked_draw(self):
+        s = game.GameState([[[['X', ' ', 'O', '-', ' ', '-']]]], game.X_PIECE, 3)
+        self.assertEqual(s.winner(), 'draw')
+
+    def test_skips_dead_squares(self):
+        """(0, 0, 0, 1) is only in dead windows"""
+        s = game.GameState([[[['X', ' ', 'O', '-', ' ', ' ', ' ', ' ']]]], game.X_PIECE, 3)
+        results = []
+        for enabled in (False, True):
+            a = TestAgent(s, game.X_PIECE)
+            a.liveness_enabled = enabled
+            results.append(a.minimax(s, 3) + (a.search_nodes,))
+        self.assertEqual(results[0][1], results[1][1])
+        self.assertNotEqual(results[1][0], (0, 0, 0, 1))
+        self.assertLess(results[1][2], results[0][2])
+
+    def test_dead_subtree_is_draw(self):
+        s = game.GameState([[[['X', 'O', 'X'], ['X', 'O', 'O'], ['O', 'X', ' ']]]], game.X_PIECE, 3)
+        a = TestAgent(s, game.X_PIECE)
+        self.assertEqual(a.minimax(s, 3), (None, 0.0))
+        self.assertEqual(a.sef_calls, 0)
+
+
+class MultiPVTest(unittest.TestCase):
+    def setUp(self):
+        self.s = game.GameState.no_corners_small().make_move((0, 0, 2, 2))
+
+    def agent(self, multi_pv):
+        a = TestAgent(self.s, game.O_PIECE)
+        a.silent = True
+        a.lmr_enabled = False
+        a.max_depth = 2
+        a.multi_pv = multi_pv
+        return a
+
+    def test_exact_values(self):
+        a = self.agent(4)
+        a.choose_move(self.s, None)
+        self.assertEqual(len(a.pv_moves), 4)
+        values = [value for _, value in a.pv_moves]
+        self.assertEqual(values, sorted(values, reverse=True))
+
+        b = self.agent(1)
+        for move, value in a.pv_moves:
+            _, child_value = b.negamax(self.s.make_move(move), a.search_depth - 1, float("-inf"), float("inf"))
+            self.assertEqual(-child_value, value)
+        for move in b.legal_moves(self.s):
+            if move not in [m for m, _ in a.pv_moves]:
+                _, child_value = b.negamax(self.s.make_move(move), a.search_depth - 1, float("-inf"), float("inf"))
+                self.assertLessEqual(-child_value, values[-1])
+
+    def test_cost_close_to_one_search(self):
+        a = self.agent(1)
+        a.choose_move(self.s, None)
+        b = self.agent(3)
+        b.choose_move(self.s, None)
+        self.assertEqual(b.pv_moves[0][1], a.search_value)
+        self.assertLess(b.search_nodes, 2 * a.search_nodes)
+
+
+class ThreatSearchTest(unittest.TestCase):
+    def setUp(self):
+        """X can make two fours at once by playing (0, 0, 3, 4)"""
+        self.s = game.GameState.empty((1, 1, 7, 7), 5)
+        x_moves = [(0, 0, 3, 1), (0, 0, 3, 2), (0, 0, 3, 3), (0, 0, 1, 4), (0, 0, 2, 4), (0, 0, 5, 4)]
+        o_moves = [(0, 0, 0, 0), (0, 0, 6, 6), (0, 0, 0, 6), (0, 0, 6, 0), (0, 0, 1, 1), (0, 0, 5, 5)]
+        for x_move, o_move in zip(x_moves, o_moves):
+            self.s = self.s.make_move(x_move).make_move(o_move)
+
+    def test_finds_forced_win(self):
+        line = threats.ThreatSearch(self.s).find_win()
+        self.assertIsNotNone(line, "Threat search missed a double four")
+        self.assertEqual(line[0], (0, 0, 3, 4))
+        state = self.s
+        for move in line:
+            state = state.make_move(move)
+        self.assertEqual(state.winner(), game.X_PIECE, "Winning line does not win")
+
+    def test_no_win_on_empty_board(self):
+        self.assertIsNone(threats.ThreatSearch(game.GameState.tic_tac_toe()).find_win())
+
+    def test_choose_move_plays_forced_win(self):
+        a = TestAgent(initial_state=self.s, piece=game.X_PIECE)
+        a.silent = True
+        self.assertEqual(a.choose_move(self.s, None), (0, 0, 3, 4))
+
+    def test_node_budget(self):
+        """X has a forced win on a 6x6 board, but it takes over 100 nodes to find"""
+        s = game.GameState.empty((1, 1, 6, 6), 4)
+        for move in [(0, 0, 0, 5), (0, 0, 5, 4), (0, 0, 0, 2), (0, 0, 1, 0), (0, 0, 2, 5), (0, 0, 1, 1)]:
+            s = s.make_move(move)
+        self.assertIsNotNone(threats.ThreatSearch(s).find_win())
+        search = threats.ThreatSearch(s)
+        self.assertIsNone(search.find_win(max_nodes=5))
+        self.assertEqual(search.nodes, 5)
+
+
+class SolverTest(unittest.TestCase):
+    def test_tic_tac_toe_is_draw(self):
+        proof = solver.ProofNumberSolver(game.GameState.tic_tac_toe()).solve()
+        self.assertEqual(proof.winner, 'draw')
+        self.assertEqual(proof.line, [])
+
+    def test_winning_line(self):
+        s = game.GameState.empty((1, 1, 4, 4), 3)
+        proof = solver.ProofNumberSolver(s).solve()
+        self.assertEqual(proof.winner, game.X_PIECE)
+        for move in proof.line:
+            self.assertIsNone(s.winner(), "Winning line continues after the game is over")
+            s = s.make_move(move)
+        self.assertEqual(s.winner(), game.X_PIECE, "Winning line does not win")
+
+    def test_bounded_memory(self):
+        s = game.GameState.tic_tac_toe().make_move((0, 0, 0, 0)).make_move((0, 0, 0, 1))
+        bounded = solver.ProofNumberSolver(s, max_entries=64).solve()
+        unbounded = solver.ProofNumberSolver(s).solve()
+        self.assertEqual(bounded.winner, game.X_PIECE)
+        self.assertEqual(bounded.winner, unbounded.winner)
+
+    def test_node_budget(self):
+        proof = solver.ProofNumberSolver(game.GameState.no_corners_small()).solve(max_nodes=100)
+        self.assertIsNone(proof.winner)
+
+
 class StaticEvalTest(unittest.TestCase):
     def setUp(self):
         self.s = game.GameState.tic_tac_toe()
@@ -115,15 +470,230 @@ class StaticEvalTest(unittest.TestCase):
         self.assertGreater(x_val, e_val, "Board of all Xs should have greater value than empty board")
 
 
+class PatternTableTest(unittest.TestCase):
+    def setUp(self):
+        self.s = game.GameState.no_corners_small()
+        for move in [(0, 0, 2, 2), (0, 0, 1, 1), (0, 0, 2, 1)]:
+            self.s = self.s.make_move(move)
+        self.a = TestAgent(initial_state=self.s, piece=game.X_PIECE)
+
+    def test_default_weights(self):
+        table = patterns.PatternTable(4)
+        self.assertEqual(table.weights, [0, 10, 100, 1000])
+        """X has 2 pieces in 2 open windows and 1 in 4, O has 1 piece in 2 open windows"""
+        self.assertEqual(self.a.static_eval(self.s), 2 * 100 + 4 * 10 - 2 * 10)
+
+    def test_tuned_weights(self):
+        self.a.eval_weights = {4: [0, 1, 5, 50]}
+        self.assertEqual(self.a.static_eval(self.s), 2 * 5 + 4 * 1 - 2 * 1)
+
+    def test_win(self):
+        s = game.GameState.tic_tac_toe()
+        for move in [(0, 0, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1), (0, 0, 1, 1), (0, 0, 0, 2)]:
+            s = s.make_move(move)
+        self.assertEqual(self.a.static_eval(s), self.a.win_value(s))
+
+
+class RecordTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.name = os.path.join(self.dir.name, 'game')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_replay(self):
+        s = game.GameState.tic_tac_toe()
+        a1 = minimax_agent.MinimaxAgent(s, game.X_PIECE)
+        a2 = minimax_agent.MinimaxAgent(s, game.O_PIECE)
+        a1.silent = a2.silent = True
+        winner = runner.GameRunner(a1, a2).run_game(s, silent=True, record_name=self.name)
+
+        header, events = transcript.read_record(self.name + '.jsonl')
+        self.assertEqual(header['k'], 3)
+        self.assertEqual(header['players'], {game.X_PIECE: a1.nickname(), game.O_PIECE: a2.nickname()})
+        self.assertEqual(events[-1], {'winner': winner})
+        self.assertEqual(transcript.replay(self.name + '.jsonl')[-1].winner(), winner)
+
+    def test_render(self):
+        s = game.GameState.no_corners_small()
+        with transcript.RecordWriter(self.name + '.jsonl', s, players={game.X_PIECE: 'a', game.O_PIECE: 'b'}) as w:
+            w.comment("Let the game begin!")
+            w.move(game.X_PIECE, (0, 0, 1, 1), 0.5)
+        transcript.render(self.name + '.jsonl')
+        with open(self.name + '.html') as file:
+            html = file.read()
+        self.assertIn("a plays (0, 0, 1, 1)", html)
+        self.assertEqual(html.count('<table>'), 2)
+
+
+class SelfPlayTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_generate(self):
+        s = game.GameState.tic_tac_toe()
+        writer = selfplay.generate(self.dir.name, s, games=4, workers=2, max_depth=1)
+        reader = selfplay.PositionReader(self.dir.name)
+        keys = [row['key'] for row in reader]
+        self.assertEqual(len(keys), len(reader))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(set(keys), writer.keys)
+        for chunk in reader.chunks():
+            self.assertTrue(set(chunk['result'].tolist()) <= {-1, 0, 1})
+            self.assertTrue(((chunk['board'] == 1).sum(axis=1) - (chunk['board'] == -1).sum(axis=1) ==
+                             (chunk['side'] == -1)).all())
+
+    def test_chunks_and_dedup(self):
+        s = game.GameState.tic_tac_toe()
+        rows = selfplay.play_game(s, seed=1, max_depth=1)
+        with selfplay.PositionWriter(self.dir.name, s, chunk_size=3) as writer:
+            for row in rows:
+                writer.add(*row)
+        with selfplay.PositionWriter(self.dir.name, s) as writer:
+            for row in rows:
+                self.assertFalse(writer.add(*row))
+        reader = selfplay.PositionReader(self.dir.name)
+        self.assertEqual(len(reader), len(rows))
+        self.assertEqual(len(list(reader.chunks())), math.ceil(len(rows) / 3))
+        self.assertEqual([row['board'].tolist() for row in reader], [row[0] for row in rows])
+
+
+class TuneTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_features_match_static_eval(self):
+        s = game.GameState.no_corners_small()
+        windows = minimax_agent.WindowIndex.of(s)
+        table = patterns.PatternTable(s.k)
+        rng = random.Random(3)
+        for _ in range(5):
+            s = game.GameState.no_corners_small()
+            for _ in range(6):
+                s = s.make_move(rng.choice([m for m in [(0, 0, i, j) for i in range(5) for j in range(5)]
+                                            if s.is_valid_move(m)]))
+            board = windows.flatten(s)
+            features, undecided = tune.window_features(np.array([[selfplay.CELL_CODES[p] for p in board]]),
+                                                       np.array(windows.windows), s.k)
+            if undecided[0]:
+                self.assertEqual(features[0] @ table.weights[1:], table.evaluate(board, windows, 0))
+
+    def test_tune_and_load(self):
+        s = game.GameState.empty((1, 1, 4, 4), 3)
+        selfplay.generate(self.dir.name, s, games=6, workers=1, opening_moves=3, max_depth=1)
+        tuner = tune.TexelTuner(self.dir.name, self.dir.name, workers=2)
+        weights, before, after = tuner.tune(iterations=20)
+        self.assertEqual(len(weights), 3)
+        self.assertLessEqual(after, before)
+
+        filename = os.path.join(self.dir.name, 'weights.json')
+        patterns.save_weights(filename, {3: weights})
+        old = minimax_agent.WEIGHTS_FILE
+        minimax_agent.WEIGHTS_FILE = filename
+        try:
+            a = minimax_agent.MinimaxAgent(s, game.X_PIECE)
+        finally:
+            minimax_agent.WEIGHTS_FILE = old
+        self.assertEqual(a.pattern_table(3).weights, weights)
+        self.assertIsNone(a.eval_weights.get(4))
+
+
+class ServerTest(unittest.TestCase):
+    async def client(self, port, requests):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = []
+        for request in requests:
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.close()
+        return responses
+
+    async def serve(self, s, *clients):
+        tcp = await s.start(port=0)
+        port = tcp.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.gather(*(self.client(port, requests) for requests in clients))
+        finally:
+            tcp.close()
+            s.close()
+
+    def test_concurrent_games(self):
+        s = server.GameServer(workers=2, move_time=1)
+        new_game = {'op': 'new_game', 'board': 'tic_tac_toe'}
+        results = asyncio.run(self.serve(s, *([new_game] + [{'op': 'play', 'game': g} for _ in range(10)]
+                                               for g in range(1, 3))))
+        self.assertEqual(sorted(responses[0]['game'] for responses in results), [1, 2])
+        moves = 0
+        for responses in results:
+            played = [r for r in responses if 'move' in r]
+            self.assertEqual(played[-1]['winner'], 'draw')
+            self.assertIn("game is over", responses[-1]['error'])
+            moves += len(played)
+        self.assertEqual(s.stats()['completed'], moves)
+
+    def test_rejects_when_busy(self):
+        s = server.GameServer(workers=1, max_queue=0)
+        responses, = asyncio.run(self.serve(s, [{'op': 'new_game', 'board': 'tic_tac_toe'},
+                                                {'op': 'play', 'game': 1, 'move': [0, 0, 1, 1]},
+                                                {'op': 'stats'}]))
+        self.assertEqual(responses[1]['error'], "server busy")
+        self.assertEqual(responses[2]['rejected'], 1)
+
+    def test_invalid_move(self):
+        s = server.GameServer(workers=1)
+        responses, = asyncio.run(self.serve(s, [{'op': 'new_game', 'board': 'tic_tac_toe'},
+                                                {'op': 'play', 'game': 1, 'move': [0, 0, 3, 3], 'id': 'a'}]))
+        self.assertEqual(responses[1], {'error': "invalid move [0, 0, 3, 3]", 'id': 'a'})
+
+
+class AnalyseTest(unittest.TestCase):
+    def test_board_strings(self):
+        s = game.GameState.no_corners_small()
+        self.assertEqual(analyse.parse_board(analyse.format_board(s.board)), s.board)
+        s = analyse.parse_position('{"board": "X.O/.X./..O", "side": "O", "k": 3}')
+        self.assertEqual(s.board, [[[['X', ' ', 'O'], [' ', 'X', ' '], [' ', ' ', 'O']]]])
+        self.assertEqual(analyse.parse_position("X.O/.X./..O O 3"), s)
+
+    def test_results_in_order(self):
+        lines = ["X.O/.X./..O O 3", "XX./OO./... X 3", "XX./OO./... O 3", ".../.X./... O 3"]
+        results = list(analyse.analyse((analyse.parse_position(line) for line in lines), depth=2, workers=2,
+                                       backlog=1))
+        self.assertEqual([r.move for r in results[:3]], [(0, 0, 1, 2), (0, 0, 0, 2), (0, 0, 1, 2)])
+        self.assertEqual(results[3], analyse.analyse_position(analyse.parse_position(lines[3]), depth=2))
+
+    def test_node_budget(self):
+        s = game.GameState.empty((1, 1, 5, 5), 4)
+        result = analyse.analyse_position(s, max_nodes=300)
+        self.assertLessEqual(result.nodes, 300)
+        self.assertGreaterEqual(result.depth, 1)
+        self.assertTrue(s.is_valid_move(result.move))
+
+
+class DifferentialTest(unittest.TestCase):
+    def test_matches_reference(self):
+        results = differential.run(positions=6, depth=2, seed=1)
+        self.assertEqual([c.operation for c in results], ['winner', 'static_eval', 'minimax'])
+        for c in results:
+            self.assertGreater(c.positions, 0)
+            self.assertEqual(c.mismatches, [], f"{c.operation} differs from the reference")
+
+
 class FullGameTest(unittest.TestCase):
     def test_7x7(self):
         wins = 0
+        s = game.GameState.empty((7, 7), 5)
+        a1 = TestAgent(s, game.X_PIECE)
+        a2 = agent.Agent(s, game.O_PIECE)
+        r = runner.GameRunner(a1, a2)
         for _ in range(5):
-            s = game.GameState.empty((7, 7), 5)
-            a1 = TestAgent(s, game.X_PIECE)
-            a2 = agent.Agent(s, game.O_PIECE)
-            r = runner.GameRunner(a1, a2)
-
             if r.run_game(s, silent=True) == game.X_PIECE:
                 wins += 1
         self.assertGreaterEqual(wins, 3)
@@ -0,0 +1,67 @@
+"""
+cache.py
+
+Bounded cache of static evaluations keyed by position hash. Unlike the transposition table, which is rebuilt for every
+move, the evaluation cache has a fixed size and is kept across moves and games of the same board.
+"""
+from array import array
+
+
+class EvalCache:
+    """
+    Evaluations stored in two flat arrays of 2 ** bits slots, one of hash keys and one of values. A key is stored in the
+    slot given by its low bits, replacing whatever was there before, so the cache never grows and a lookup is a single
+    array access. Keys are stored in full so that two positions sharing a slot are told apart.
+    """
+
+    def __init__(self, bits: int = 16):
+        """
+        :param bits: log2 of the number of slots
+        """
+        self.mask = (1 << bits) - 1
+        self.keys = array('Q', [0]) * (1 << bits)
+        self.values = array('d', [0.0]) * (1 << bits)
+        self.used = array('b', [0]) * (1 << bits)
+        self.lookups = 0
+        self.hits = 0
+
+    def get(self, key: int) -> [float, None]:
+        """
+        Looks up the evaluation of a position.
+        :param key: position hash
+        :return: cached evaluation, or None if the position is not in the cache
+        """
+        self.lookups += 1
+        slot = key & self.mask
+        if self.used[slot] and self.keys[slot] == key:
+            self.hits += 1
+            return self.values[slot]
+        return None
+
+    def put(self, key: int, value: float):
+        """
+        Stores the evaluation of a position.
+        :param key: position hash
+        :param value: evaluation
+        """
+        slot = key & self.mask
+        self.keys[slot] = key
+        self.values[slot] = value
+        self.used[slot] = 1
+
+    def clear(self):
+        self.used = array('b', [0]) * len(self.used)
+        self.lookups = 0
+        self.hits = 0
+
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups that found the position, 0 if there were none.
+        """
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def fill(self) -> float:
+        """
+        Fraction of slots in use.
+        """
+        return sum(self.used) / len(self.used)
@@ -0,0 +1,220 @@
+"""
+differential.py
+
+Checks that the optimized paths of the engine give the same answers as the straightforward reference code they
+replaced, on random positions across board shapes and values of k, and reports how much faster each one is:
+    winner         GameState.winner() against WindowIndex.winner()
+    static_eval    the original loop over every window against MinimaxAgent.static_eval() (pattern table)
+    minimax        full-width minimax against MinimaxAgent.minimax() with its exact pruning on
+Late move reductions are switched off for the minimax comparison, because reduced searches are allowed to return
+different values. Run this file to check every shape:
+    python3 differential.py --positions 50 --depth 2
+"""
+import argparse
+import game
+import minimax_agent
+import random
+import time
+from dataclasses import dataclass
+from windows import WindowIndex
+
+"""Board shapes and k to compare on"""
+SHAPES = [
+    ((1, 1, 3, 3), 3),
+    ((1, 1, 4, 4), 3),
+    ((1, 1, 5, 5), 4),
+    ((1, 1, 4, 6), 4),
+    ((1, 1, 7, 7), 5),
+    ((1, 3, 3, 3), 3),
+    ((2, 2, 3, 3), 2),
+]
+
+
+@dataclass
+class Comparison:
+    """
+    Result of comparing one operation: the number of positions compared, the positions where the two paths disagree,
+    and the time each path took over all positions.
+    """
+    operation: str
+    positions: int
+    mismatches: list
+    reference_seconds: float
+    optimized_seconds: float
+
+    @property
+    def speedup(self) -> float:
+        return self.reference_seconds / self.optimized_seconds if self.optimized_seconds else float('inf')
+
+
+def reference_static_eval(state: game.GameState) -> float:
+    """
+    The original static evaluation: every window without the other player's pieces or a block scores 10 ** pieces for
+    the player in it, and the first completed window in window order decides a won position.
+    """
+    d = state.d
+    win_value = 10.0 ** (state.k + 5)
+    x_value = 0
+    o_value = 0
+    for direction in state.directions:
+        for i in range(d[0]):
+            for j in range(d[1]):
+                for k in range(d[2]):
+                    for x in range(d[3]):
+                        valid, steps = state.is_valid_starting_point((i, j, k, x), direction)
+                        if valid:
+                            for step in range(steps):
+                                x_pieces = 0
+                                o_pieces = 0
+                                x_blocked = False
+                                o_blocked = False
+                                for c in range(state.k):
+                                    p = (i + direction[0] * (step + c),
+                                         j + direction[1] * (step + c),
+                                         k + direction[2] * (step + c),
+                                         x + direction[3] * (step + c))
+                                    value = state.board[p[0]][p[1]][p[2]][p[3]]
+                                    if value == game.X_PIECE:
+                                        x_pieces += 1
+                                        o_blocked = True
+                                    elif value == game.O_PIECE:
+                                        o_pieces += 1
+                                        x_blocked = True
+                                    elif value == game.BLOCK_PIECE:
+                                        x_blocked = True
+                                        o_blocked = True
+
+                                if not x_blocked:
+                                    if x_pieces == state.k:
+                                        return win_value
+                                    elif x_pieces != 0:
+                                        x_value += 10 ** x_pieces
+                                if not o_blocked:
+                                    if o_pieces == state.k:
+                                        return -win_value
+                                    elif o_pieces != 0:
+                                        o_value += 10 ** o_pieces
+    return x_value - o_value
+
+
+def reference_minimax(state: game.GameState, depth: int) -> float:
+    """
+    Full-width minimax without pruning or hashing, scoring positions the same way as MinimaxAgent: a win is worth
+    win_value * (depth remaining + 1) to the winner, and a drawn position is worth 0.
+    :return: value of the state, larger is better for X
+    """
+    if depth == 0:
+        return reference_static_eval(state)
+    if state.winner() == 'draw':
+        return 0.0
+    sign = 1 if state.next_player == game.X_PIECE else -1
+    win_value = 10.0 ** (state.k + 5) * (depth + 1)
+    values = []
+    for i, plane in enumerate(state.board):
+        for j, grid in enumerate(plane):
+            for k, row in enumerate(grid):
+                for x, piece in enumerate(row):
+                    if piece == game.EMPTY_PIECE:
+                        new_state = state.make_move((i, j, k, x))
+                        if new_state.winner() == state.next_player:
+                            values.append(sign * win_value)
+                        else:
+                            values.append(reference_minimax(new_state, depth - 1))
+    return max(values) if sign == 1 else min(values)
+
+
+def random_position(size: (int, int, int, int), k: int, rng: random.Random, blocks: int = 0) -> game.GameState:
+    """
+    Places some blocks on an empty board and plays random moves, stopping when the game ends or at a random move count.
+    """
+    state = game.GameState.empty(size, k, rng.choice((game.X_PIECE, game.O_PIECE)))
+    cells = [(i, j, kk, x) for i in range(size[0]) for j in range(size[1]) for kk in range(size[2])
+             for x in range(size[3])]
+    for move in rng.sample(cells, min(blocks, len(cells))):
+        state.board[move[0]][move[1]][move[2]][move[3]] = game.BLOCK_PIECE
+    for _ in range(rng.randrange(len(cells) + 1)):
+        empty = [move for move in cells if state.board[move[0]][move[1]][move[2]][move[3]] == game.EMPTY_PIECE]
+        if not empty or state.winner():
+            break
+        state = state.make_move(rng.choice(empty))
+    return state
+
+
+def compare(operation: str, states: list, reference, optimized) -> Comparison:
+    """
+    Runs both paths over every state, timing each.
+    """
+    start = time.perf_counter()
+    expected = [reference(state) for state in states]
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [optimized(state) for state in states]
+    optimized_seconds = time.perf_counter() - start
+    mismatches = [(state, e, a) for state, e, a in zip(states, expected, actual) if e != a]
+    return Comparison(operation, len(states), mismatches, reference_seconds, optimized_seconds)
+
+
+def run(shapes: list = None, positions: int = 20, depth: int = 2, seed: int = 0, max_search_cells: int = 25) -> list:
+    """
+    Compares every operation on random positions of every shape.
+    :param shapes: list of (size, k), defaults to SHAPES
+    :param positions: random positions per shape
+    :param depth: minimax search depth
+    :param seed: random seed
+    :param max_search_cells: boards with more squares than this are left out of the minimax comparison, which is
+        slow for the reference search
+    :return: one Comparison per operation, totalled over the shapes
+    """
+    rng = random.Random(seed)
+    totals = dict()
+    for size, k in shapes or SHAPES:
+        cells = size[0] * size[1] * size[2] * size[3]
+        states = [random_position(size, k, rng, blocks=rng.randrange(cells // 4 + 1)) for _ in range(positions)]
+        windows = WindowIndex.of(states[0])
+        a = minimax_agent.MinimaxAgent(states[0], game.X_PIECE)
+        a.silent = True
+        a.eval_weights = None
+        a.lmr_enabled = False
+
+        def optimized_minimax(state):
+            z_table = a.zobrist_table(cells)
+            _, value = a.minimax(state, depth, z_hashing=(z_table, dict(), a.hash_key(state, z_table)))
+            return value
+
+        searchable = [state for state in states if not state.winner()]
+        results = [compare('winner', states, game.GameState.winner,
+                           lambda state: windows.winner(windows.flatten(state))),
+                   compare('static_eval', states, reference_static_eval, a.static_eval)]
+        if cells <= max_search_cells:
+            results.append(compare('minimax', searchable, lambda state: reference_minimax(state, depth),
+                                   optimized_minimax))
+
+        for result in results:
+            if result.operation not in totals:
+                totals[result.operation] = Comparison(result.operation, 0, [], 0.0, 0.0)
+            total = totals[result.operation]
+            total.positions += result.positions
+            total.mismatches += result.mismatches
+            total.reference_seconds += result.reference_seconds
+            total.optimized_seconds += result.optimized_seconds
+    return list(totals.values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the optimized engine against the reference code.")
+    parser.add_argument('--positions', type=int, default=20, help="random positions per board shape")
+    parser.add_argument('--depth', type=int, default=2, help="minimax search depth")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'operation':<12} {'positions':>9} {'mismatches':>10} {'reference':>10} {'optimized':>10} {'speedup':>8}")
+    for c in run(positions=args.positions, depth=args.depth, seed=args.seed):
+        print(f"{c.operation:<12} {c.positions:>9} {len(c.mismatches):>10} {c.reference_seconds:>9.3f}s "
+              f"{c.optimized_seconds:>9.3f}s {c.speedup:>7.1f}x")
+        for state, expected, actual in c.mismatches[:5]:
+            failed = True
+            print(f"  {c.operation} mismatch: reference {expected}, optimized {actual}, k={state.k}, "
+                  f"next_player={state.next_player}, board={state.board}")
+    if failed:
+        raise SystemExit(1)
@@ -124,7 +124,8 @@ class GameState:
 
     def winner(self) -> [str, None]:
         """
-        Determines if any agent has won the game.
+        Determines if any agent has won the game. The game is a draw once the board is full, or once every window holds
+        a block or pieces of both players, so that neither player can win any more.
         :return: token of the winning player, 'draw', or None
         """
 
@@ -132,6 +133,7 @@ class GameState:
         # print(len(self.directions))
 
         empty_spaces = 0
+        live_windows = False
 
         for direction in self.directions:
             # print()
@@ -148,6 +150,7 @@ class GameState:
                                 for step in range(steps):
                                     x_pieces = 0
                                     o_pieces = 0
+                                    blocked = False
                                     for c in range(self.k):
                                         p = (i + direction[0] * (step + c),
                                              j + direction[1] * (step + c),
@@ -158,15 +161,20 @@ class GameState:
                                             x_pieces += 1
                                         elif value == O_PIECE:
                                             o_pieces += 1
-                                        if x_pieces < c and o_pieces < c:
+                                        elif value == BLOCK_PIECE:
+                                            blocked = True
+                                        # only stop early once a live window has been found
+                                        if live_windows and x_pieces < c and o_pieces < c:
                                             break
 
                                     if x_pieces == self.k:
                                         return X_PIECE
                                     elif o_pieces == self.k:
                                         return O_PIECE
+                                    if not blocked and (x_pieces == 0 or o_pieces == 0):
+                                        live_windows = True
 
-        if empty_spaces == 0:
+        if empty_spaces == 0 or not live_windows:
             return 'draw'
         else:
             return None
@@ -4,17 +4,74 @@ author: <YOUR NAME(s) HERE>
 """
 import agent
 import game
+import math
+import os
 import time
-import random
+from cache import EvalCache
+from patterns import PatternTable, load_weights
+from threats import ThreatSearch
+from windows import WindowIndex, load_geometry, zobrist_table
+
+
+"""Transposition table entry flags"""
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+"""Weight file written by tune.py, loaded at startup if it exists"""
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weights.json')
 
 
 class MinimaxAgent(agent.Agent):
     def __init__(self, initial_state: game.GameState, piece: str):
         super().__init__(initial_state, piece)
         self.eval_calls = 0
+        self.search_nodes = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+        self.futility_prunes = 0
         self.wrapup_time = 0.1
+        self.max_depth = 3
+        self.max_nodes = None
+        self.search_depth = 0
+        self.search_value = None
+        self.multi_pv = 1
+        self.pv_moves = []
+        self.aspiration_window = 0.25
         self.silent = False
 
+        """Zobrist hash tables by board size and seed, kept across moves. Seeded so that searches repeat exactly"""
+        self.seed = 0
+        self.z_tables = dict()
+
+        """Cache of static evaluations, kept across moves while the board layout and hash table stay the same"""
+        self.eval_cache_enabled = True
+        self.eval_cache = EvalCache()
+        self.eval_cache_board = None
+        self.eval_cache_table = None
+
+        """Window score weights per k from the weight file, None for the default powers of ten"""
+        self.eval_weights = load_weights(WEIGHTS_FILE)
+        self.pattern_tables = dict()
+
+        """Selective search settings, switch these off to measure their effect"""
+        self.lmr_enabled = True
+        self.lmr_min_depth = 3
+        self.lmr_late_moves = 4
+        self.lmr_reduction = 1
+        self.futility_enabled = True
+        self.futility_margin = 0.0
+        self.selective_depth = 2
+
+        """Dead position pruning: stop where neither player can win, and skip squares that are only in dead windows"""
+        self.liveness_enabled = True
+
+        """Threat-space search for forced wins, run before the full-width search"""
+        self.threat_enabled = True
+        self.threat_time = 0.1
+        self.threat_nodes = 20000
+        self.threat_depth = 8
+
     def introduce(self):
         """
         returns a multi-line introduction string
@@ -40,11 +97,18 @@ class MinimaxAgent(agent.Agent):
         """
 
         self.eval_calls = 0
+        self.search_nodes = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+        self.futility_prunes = 0
+        self.search_depth = 0
+        self.search_value = None
+        self.pv_moves = []
         d = state.d
-        k = state.k
 
         """Default best move is first available empty space"""
         best_move = None
+        best_value = None
         max_depth = 0
         for i in range(d[0]):
             for j in range(d[1]):
@@ -52,30 +116,60 @@ class MinimaxAgent(agent.Agent):
                     for x in range(d[3]):
                         if state.board[i][j][k][x] == game.EMPTY_PIECE:
                             max_depth += 1
-                            if best_move is not None:
+                            if best_move is None:
                                 best_move = (i, j, k, x)
 
-        """Limit the maximum search depth to 3"""
-        max_depth = min(max_depth, 3)
+        """Limit the maximum search depth, allowing deeper searches when selective search makes them affordable"""
+        depth_limit = self.max_depth
+        if self.lmr_enabled or self.futility_enabled:
+            depth_limit += self.selective_depth
+        max_depth = min(max_depth, depth_limit)
 
-        """Perform iterative deepening search until depth limit or time limit reached"""
+        """Start a new transposition table, shared by every iteration so earlier results can order later searches"""
+        z_table = self.zobrist_table(d[0] * d[1] * d[2] * d[3])
+        z_hashing = (z_table, dict(), self.hash_key(state, z_table))
+
+        """Keep the evaluation cache while the board shape, k and blocks stay the same"""
+        self.check_eval_cache(state, z_table)
+
+        """
+        Look for a forced win by continuous threats first, giving it a small slice of the time limit. Without a time
+        limit both searches are bounded by depth and nodes only, so they give the same move and stats on every run
+        """
         timeout = time.perf_counter() + time_limit if time_limit is not None else None
+        if self.threat_enabled:
+            threat_timeout = None
+            if time_limit is not None:
+                threat_timeout = time.perf_counter() + min(self.threat_time, time_limit / 10)
+            line = ThreatSearch(state, z_table).find_win(self.threat_depth, threat_timeout, self.threat_nodes)
+            if line is not None:
+                best_move = line[0]
+                best_value = self.win_value(state)
+                max_depth = 0
+                if not self.silent:
+                    print(f"forced win found, line={line}")
+
+        """Perform iterative deepening search until depth limit or time limit reached"""
         depth = 1
         while depth <= max_depth:
 
-            """Initialise Zobrist hash table"""
-            z_table = [[random.getrandbits(32) for _ in range(2)] for _ in range(d[0] * d[1] * d[2] * d[3])]
-            z_hashing = (z_table, dict(), 0)
-
-            """Search for best value at current depth"""
-            latest_time_limit = timeout - time.perf_counter() if timeout is not None else None
-            move, value = self.minimax(state, depth, latest_time_limit, float("-inf"), float("inf"), z_hashing)
+            if self.multi_pv > 1:
+                """Search for the best few moves at current depth, trying the previous iteration's best moves first"""
+                pv_moves = self.multipv_search(state, depth, self.multi_pv, timeout, z_hashing,
+                                               [m for m, _ in self.pv_moves])
+                move, value = pv_moves[0] if pv_moves else (None, None)
+            else:
+                """Search for best value at current depth, using a window around the previous value"""
+                move, value = self.aspiration_search(state, depth, best_value, timeout, z_hashing)
+                pv_moves = [(move, value)]
 
-            if time_limit is None or time.perf_counter() < timeout - self.wrapup_time:
+            if value is not None and (time_limit is None or time.perf_counter() < timeout - self.wrapup_time):
 
                 """Full search complete, update best_move"""
                 best_move = move
                 best_value = value
+                self.pv_moves = pv_moves
+                self.search_depth = depth
                 if not self.silent:
                     print(f"depth={depth}, best_move={best_move}, best_value={best_value}")
 
@@ -86,25 +180,126 @@ class MinimaxAgent(agent.Agent):
                 """Time limit reached, exit search"""
                 break
 
+        """Value of the chosen move from the perspective of the player to move, None if no search completed"""
+        self.search_value = best_value
+        if not self.pv_moves:
+            self.pv_moves = [(best_move, best_value)]
+
         if not self.silent:
 
             if timeout is not None:
                 """Report remaining time"""
                 print(f"Exited {round(timeout - time.perf_counter(), 4)} seconds remaining before timeout")
 
-            """Report total number of static evaluations made"""
-            print(f"Called static_eval() {self.eval_calls} times")
+            """Report total number of static evaluations and nodes searched"""
+            print(f"Called static_eval() {self.eval_calls} times, searched {self.search_nodes} nodes")
+            if self.eval_cache_enabled:
+                print(f"Evaluation cache hit rate {round(self.eval_cache.hit_rate(), 3)} "
+                      f"over {self.eval_cache.lookups} lookups, {round(self.eval_cache.fill(), 3)} full")
+            print(f"Reduced {self.lmr_reductions} late moves ({self.lmr_researches} searched again), "
+                  f"pruned {self.futility_prunes} futile moves")
 
             self.print_board(state, best_move)
 
         return best_move
 
+    def aspiration_search(self, state: game.GameState, depth: int, guess: float = None, timeout: float = None,
+                          z_hashing=None) -> ((int, int), float):
+        """
+        Runs negamax at the given depth with a narrow window centred on the value of the previous iteration. If the
+        result falls outside the window, the failing bound is opened and the position searched again.
+        :param state: State to evaluate
+        :param depth: number of layers to evaluate
+        :param guess: value of the previous iteration (from the perspective of the player to move), or None
+        :param timeout: time.perf_counter() value to finish by. None means no time limit
+        :param z_hashing: zobrist hashing data
+        :return: move (x,y) or None, state evaluation from the perspective of the player to move
+        """
+        if guess is None:
+            return self.negamax(state, depth, float("-inf"), float("inf"), timeout, z_hashing)
+
+        delta = max(abs(guess) * self.aspiration_window, 1.0)
+        alpha = guess - delta
+        beta = guess + delta
+        while True:
+            move, value = self.negamax(state, depth, alpha, beta, timeout, z_hashing)
+            if value is None:
+                return None, None
+            elif value <= alpha:
+                alpha = float("-inf")
+            elif value >= beta:
+                beta = float("inf")
+            else:
+                return move, value
+
+    def multipv_search(self, state: game.GameState, depth: int, n: int, timeout: float = None, z_hashing=None,
+                       order: list = None) -> list:
+        """
+        Finds the best n moves at the given depth with exact values, in one pass over the root moves. Every root move is
+        scouted with a zero window around the n-th best value found so far, and searched again with an open window only
+        if it beats it, so the cost stays close to that of a single search. The transposition table is shared by all
+        root moves.
+        :param state: State to evaluate
+        :param depth: number of layers to evaluate
+        :param n: number of moves to find
+        :param timeout: time.perf_counter() value to finish by. None means no time limit
+        :param z_hashing: zobrist hashing data
+        :param order: moves to search first, such as the best moves of the previous iteration
+        :return: list of up to n (move, value) pairs, best first, values from the perspective of the player to move.
+            None on timeout
+        """
+        self.search_nodes += 1
+        a_piece = state.next_player
+        windows = WindowIndex.of(state)
+        x_counts, o_counts = windows.open_counts(windows.flatten(state))
+        moves = self.legal_moves(state)
+        if self.liveness_enabled:
+            moves = self.live_moves(moves, windows, x_counts, o_counts)
+        if order:
+            moves.sort(key=lambda m: order.index(m) if m in order else len(order))
+
+        scores = []
+        for move in moves:
+            index = windows.index(move)
+            new_counts = windows.play_counts(x_counts, o_counts, index, a_piece)
+            own_counts = new_counts[0] if a_piece == game.X_PIECE else new_counts[1]
+            new_z_hashing = None
+            if z_hashing is not None:
+                z_table, z_memory, z_key = z_hashing
+                new_z_hashing = (z_table, z_memory, z_key ^ z_table[index][0 if a_piece == game.X_PIECE else 1])
+
+            if any(own_counts[w] == state.k for w in windows.cell_windows[index]):
+                value = self.win_value(state) * (depth + 1)
+            else:
+                new_state = state.make_move(move)
+                if len(scores) < n:
+                    _, value = self.negamax(new_state, depth - 1, float("-inf"), float("inf"), timeout,
+                                            new_z_hashing, new_counts)
+                    value = None if value is None else -value
+                else:
+                    """Only a move that beats the n-th best value needs an exact value"""
+                    alpha = scores[n - 1][1]
+                    _, value = self.negamax(new_state, depth - 1, -math.nextafter(alpha, math.inf), -alpha, timeout,
+                                            new_z_hashing, new_counts)
+                    value = None if value is None else -value
+                    if value is not None and value > alpha:
+                        _, value = self.negamax(new_state, depth - 1, float("-inf"), -alpha, timeout, new_z_hashing,
+                                                new_counts)
+                        value = None if value is None else -value
+                if value is None:
+                    return None
+
+            scores.append((move, value))
+            scores.sort(key=lambda score: -score[1])
+        return scores[:n]
+
     def minimax(self, state: game.GameState, depth_remaining: int, time_limit: float = None,
                 alpha: float = None, beta: float = None, z_hashing=None) -> ((int, int), float):
         """
         Uses minimax to evaluate the given state and choose the best action from this state. Uses the next_player of the
         given state to decide between min and max. Recursively calls itself to reach depth_remaining layers. Optionally
         uses alpha, beta for pruning, and/or z_hashing for zobrist hashing.
+        The search itself is done by negamax; this converts the window and result to and from X's perspective.
         :param state: State to evaluate
         :param depth_remaining: number of layers left to evaluate
         :param time_limit: argument for your use to make sure you return before the time limit. None means no time limit
@@ -113,163 +308,375 @@ class MinimaxAgent(agent.Agent):
         :param z_hashing: zobrist hashing data
         :return: move (x,y) or None, state evaluation
         """
+        alpha = float("-inf") if alpha is None else alpha
+        beta = float("inf") if beta is None else beta
+        timeout = time.perf_counter() + time_limit if time_limit is not None else None
+
+        if state.next_player == game.X_PIECE:
+            return self.negamax(state, depth_remaining, alpha, beta, timeout, z_hashing)
+
+        move, value = self.negamax(state, depth_remaining, -beta, -alpha, timeout, z_hashing)
+        return move, None if value is None else -value
+
+    def negamax(self, state: game.GameState, depth_remaining: int, alpha: float, beta: float,
+                timeout: float = None, z_hashing=None, counts: tuple = None) -> ((int, int), float):
+        """
+        Fail-soft negamax with principal variation search. The first move is searched with the full window, every later
+        move with a zero window around alpha, and only moves that fail high on the zero window are searched again.
+        When selective search or dead position pruning is on, the window counts of each position are passed down and
+        updated move by move.
+        :param state: State to evaluate
+        :param depth_remaining: number of layers left to evaluate
+        :param alpha: lower bound, from the perspective of the player to move
+        :param beta: upper bound, from the perspective of the player to move
+        :param timeout: time.perf_counter() value to finish by. None means no time limit
+        :param z_hashing: zobrist hashing data
+        :param counts: (X counts, O counts) per window of this state from WindowIndex.open_counts(), or None
+        :return: move (x,y) or None, state evaluation from the perspective of the player to move (None on timeout)
+        """
+
+        if timeout is not None and time.perf_counter() > timeout - self.wrapup_time:
+            """Exit early if reached time limit"""
+            return None, None
+        if self.max_nodes is not None and self.search_nodes >= self.max_nodes:
+            """Exit early if reached node budget"""
+            return None, None
 
+        self.search_nodes += 1
         d = state.d
         a_piece = state.next_player
 
-        """Generate Zobrist hash for the current board state"""
+        """Look up the current board state in the transposition table"""
         (z_table, z_memory, z_key) = (None, None, None)
         if z_hashing is not None:
             (z_table, z_memory, z_key) = z_hashing
 
-        if time_limit is not None and time_limit < self.wrapup_time:
-            """Exit early if reached time limit"""
-            return None, None
-        elif depth_remaining == 0:
+        tt_move = None
+        if z_memory is not None and z_key in z_memory:
+            (tt_depth, tt_flag, tt_move, tt_value) = z_memory[z_key]
+            if tt_move is not None and not state.is_valid_move(tt_move):
+                """Hash collision with a different position, ignore the entry"""
+                tt_move = None
+            elif tt_depth >= depth_remaining:
+                if (tt_flag == EXACT or
+                        (tt_flag == LOWER and tt_value >= beta) or
+                        (tt_flag == UPPER and tt_value <= alpha)):
+                    return tt_move, tt_value
+
+        if depth_remaining == 0:
             """Return static evaluation if reached depth limit"""
-            value = self.static_eval(state)
+            value = self.cached_eval(state, z_table, z_key)
+            if a_piece == game.O_PIECE:
+                value = -value
             if z_memory is not None:
-                z_memory[z_key] = (None, value)
+                z_memory[z_key] = (0, EXACT, None, value)
             return None, value
-        else:
-            """Otherwise do minimax"""
-
-            timeout = None
-            if time_limit is not None:
-                timeout = time.perf_counter() + time_limit
-
-            best_move = None
-            best_value = float("-inf") if a_piece == game.X_PIECE else float("inf")
-
-            # """Default best move is first available empty space"""
-            # for i in range(w):
-            #     for j in range(h):
-            #         if state.board[i][j] == game.EMPTY_PIECE:
-            #             best_move = (i, j)
-            #             i = w - 1
-            #             break
-
-            for i in range(d[0]):
-                for j in range(d[1]):
-                    for k in range(d[2]):
-                        for x in range(d[3]):
-                            """Iterate until all spaces have been tried, exit early if time limit is reached"""
-                            if timeout is None or time.perf_counter() < timeout - self.wrapup_time:
-
-                                if state.board[i][j][k][x] == game.EMPTY_PIECE:
-
-                                    """Play A in square (i,j,k,x,y), update Zobrist hash"""
-                                    new_state = state.make_move((i, j, k, x))
-                                    new_z_key = None
-                                    if z_hashing is not None:
-                                        z_index = 0 if a_piece == game.X_PIECE else 1
-                                        board_index = (i * d[1] * d[2] * d[3] +
-                                                       j * d[2] * d[3] +
-                                                       k * d[3] +
-                                                       x)
-                                        new_z_key = z_key ^ z_table[board_index][z_index]
-
-                                    if new_z_key is not None and new_z_key in z_memory:
-                                        """If already calculated for this state, no need to search further"""
-                                        (move, value) = z_memory[new_z_key]
-                                    elif new_state.winner() == a_piece:
-                                        """If A has won, no need to search further"""
-                                        value = self.static_eval(new_state) / 10 ** (depth_remaining - 1)
-                                    else:
-                                        """Run minimax on new state"""
-                                        new_time_limit = None
-                                        if timeout is not None:
-                                            new_time_limit = timeout - time.perf_counter()
-                                        new_z_hashing = (z_table, z_memory, new_z_key)
-                                        move, value = self.minimax(new_state, depth_remaining - 1, new_time_limit,
-                                                                   alpha, beta, new_z_hashing)
-
-                                    """Exit early if reached time limit"""
-                                    if value is None:
-                                        break
-
-                                    """Update best move, alpha and beta"""
-                                    if a_piece == game.X_PIECE:
-                                        if value > best_value:
-                                            best_move = (i, j, k, x)
-                                            best_value = value
-                                        if beta is not None and best_value > beta:
-                                            return best_move, best_value
-                                        elif alpha is not None:
-                                            alpha = max(alpha, best_value)
-                                    elif a_piece == game.O_PIECE:
-                                        if value < best_value:
-                                            best_move = (i, j, k, x)
-                                            best_value = value
-                                        if alpha is not None and best_value < alpha:
-                                            return best_move, best_value
-                                        elif beta is not None:
-                                            beta = min(beta, best_value)
-
-                            else:
-                                """Exit early if reached time limit"""
-                                break
 
+        moves = self.legal_moves(state)
+        if not moves:
+            """No moves left, the game is a draw"""
+            return None, 0.0
+
+        if self.lmr_enabled or self.futility_enabled or self.liveness_enabled:
+            windows = WindowIndex.of(state)
+            if counts is None:
+                counts = windows.open_counts(windows.flatten(state))
+            x_counts, o_counts = counts
+
+        if self.liveness_enabled:
+            """A window is dead once it holds a block or both players' pieces, and so can never be won"""
+            if all(x_count < 0 and o_count < 0 for x_count, o_count in zip(x_counts, o_counts)):
+                """Neither player can win any more, the game is a draw"""
+                return None, 0.0
+            moves = self.live_moves(moves, windows, x_counts, o_counts)
+
+        """Find the moves that extend or block a threat, and search them before the quiet moves"""
+        tactical = None
+        if self.lmr_enabled or self.futility_enabled:
+            tactical = {move for move in moves if self.is_tactical(windows.index(move), windows, x_counts, o_counts)}
+            moves.sort(key=lambda m: m not in tactical)
+        if tt_move in moves:
+            """Search the best move from an earlier search first"""
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+
+        """Quiet moves can only be pruned as futile at frontier nodes outside the principal variation"""
+        pv_node = beta > math.nextafter(alpha, math.inf)
+        futility_base = None
+        if self.futility_enabled and depth_remaining == 1 and not pv_node:
+            futility_base = self.cached_eval(state, z_table, z_key)
+            if a_piece == game.O_PIECE:
+                futility_base = -futility_base
+
+        original_alpha = alpha
+        best_move = None
+        best_value = float("-inf")
+
+        for n, move in enumerate(moves):
+            quiet = n > 0 and tactical is not None and move not in tactical
+
+            if quiet and futility_base is not None:
+                """Skip a quiet move that cannot raise the evaluation above alpha"""
+                gain = self.quiet_gain(windows.index(move), a_piece, x_counts, o_counts, windows)
+                futility_value = futility_base + gain + self.futility_margin
+                if futility_value <= alpha:
+                    self.futility_prunes += 1
+                    best_value = max(best_value, futility_value)
+                    continue
+
+            """Play A in square (i,j,k,x), update Zobrist hash"""
+            new_state = state.make_move(move)
+            new_z_hashing = None
             if z_hashing is not None:
-                z_memory[z_key] = (best_move, best_value)
+                z_index = 0 if a_piece == game.X_PIECE else 1
+                board_index = (move[0] * d[1] * d[2] * d[3] +
+                               move[1] * d[2] * d[3] +
+                               move[2] * d[3] +
+                               move[3])
+                new_z_hashing = (z_table, z_memory, z_key ^ z_table[board_index][z_index])
+
+            new_counts = None
+            if counts is not None:
+                index = windows.index(move)
+                new_counts = windows.play_counts(x_counts, o_counts, index, a_piece)
+                own_counts = new_counts[0] if a_piece == game.X_PIECE else new_counts[1]
+                won = any(own_counts[w] == state.k for w in windows.cell_windows[index])
+            else:
+                won = new_state.winner() == a_piece
+
+            if won:
+                """If A has won, no need to search further"""
+                value = self.win_value(state) * (depth_remaining + 1)
+            elif n == 0:
+                """Search the principal variation with the full window"""
+                _, value = self.negamax(new_state, depth_remaining - 1, -beta, -alpha, timeout, new_z_hashing,
+                                        new_counts)
+                value = None if value is None else -value
+            else:
+                """Scout the remaining moves with a zero window, searching again only if one fails high"""
+                scout_beta = -math.nextafter(alpha, math.inf)
+                new_depth = depth_remaining - 1
+                if (quiet and self.lmr_enabled and depth_remaining >= self.lmr_min_depth and
+                        n >= self.lmr_late_moves):
+                    """Late quiet moves are scouted at reduced depth first, and at full depth if they fail high"""
+                    self.lmr_reductions += 1
+                    _, value = self.negamax(new_state, max(new_depth - self.lmr_reduction, 0), scout_beta, -alpha,
+                                            timeout, new_z_hashing, new_counts)
+                    value = None if value is None else -value
+                    if value is not None and value > alpha:
+                        self.lmr_researches += 1
+                        _, value = self.negamax(new_state, new_depth, scout_beta, -alpha, timeout, new_z_hashing,
+                                                new_counts)
+                        value = None if value is None else -value
+                else:
+                    _, value = self.negamax(new_state, new_depth, scout_beta, -alpha, timeout, new_z_hashing,
+                                            new_counts)
+                    value = None if value is None else -value
+                if value is not None and alpha < value < beta:
+                    _, value = self.negamax(new_state, new_depth, -beta, -alpha, timeout, new_z_hashing, new_counts)
+                    value = None if value is None else -value
+
+            """Exit early if reached time limit"""
+            if value is None:
+                return None, None
+
+            """Update best move and alpha, cut off once the window closes"""
+            if value > best_value:
+                best_move = move
+                best_value = value
+            if best_value > alpha:
+                alpha = best_value
+            if best_value >= beta:
+                break
+
+        if z_memory is not None:
+            if best_value <= original_alpha:
+                flag = UPPER
+            elif best_value >= beta:
+                flag = LOWER
+            else:
+                flag = EXACT
+            z_memory[z_key] = (depth_remaining, flag, best_move, best_value)
 
-            return best_move, best_value
+        return best_move, best_value
+
+    def new_game(self, initial_state: game.GameState, piece: str = None):
+        """
+        Gets the agent ready to play another game, so that one agent can play many. Everything that only depends on the
+        board is kept: the window index, Zobrist table and pattern table are built now if the shape or k is new, and the
+        evaluation cache is kept if the board shape, k and blocks are the same as before.
+        :param initial_state: starting state of the game
+        :param piece: piece to play in the game, None to keep the same piece
+        """
+        if piece is not None:
+            self.piece = piece
+        self._move = None
+        self.search_depth = 0
+        self.search_value = None
+        self.pv_moves = []
+        windows = WindowIndex.of(initial_state)
+        self.pattern_table(initial_state.k)
+        self.check_eval_cache(initial_state, self.zobrist_table(windows.size))
+
+    def load_geometry(self, filename: str) -> WindowIndex:
+        """
+        Loads a window index and Zobrist table written by windows.save_geometry(), so that they are not built again.
+        The Zobrist table is only used if it has the agent's seed.
+        :param filename: geometry file
+        :return: window index
+        """
+        windows, seed, z_table = load_geometry(filename)
+        self.z_tables.setdefault((windows.size, seed), z_table)
+        return windows
+
+    def check_eval_cache(self, state: game.GameState, z_table: list):
+        """
+        Clears the evaluation cache unless it was filled on a board with the same shape, k and blocks as the given
+        state, and with the same Zobrist table.
+        :param state: state about to be searched
+        :param z_table: Zobrist hash table of the search
+        """
+        board = (tuple(state.d), state.k, tuple(i for i, piece in enumerate(WindowIndex.of(state).flatten(state))
+                                                if piece == game.BLOCK_PIECE))
+        if board != self.eval_cache_board or z_table is not self.eval_cache_table:
+            self.eval_cache.clear()
+            self.eval_cache_board = board
+            self.eval_cache_table = z_table
+
+    def cached_eval(self, state: game.GameState, z_table: list, z_key: int) -> float:
+        """
+        Returns static_eval(state), looking it up in the evaluation cache when the position is hashed with the table
+        the cache was filled with.
+        :param state: state to evaluate
+        :param z_table: Zobrist hash table of the search, or None
+        :param z_key: hash key of the state
+        :return: evaluation, larger is better for X
+        """
+        if not self.eval_cache_enabled or z_table is None or z_table is not self.eval_cache_table:
+            return self.static_eval(state)
+        value = self.eval_cache.get(z_key)
+        if value is None:
+            value = self.static_eval(state)
+            self.eval_cache.put(z_key, value)
+        return value
+
+    def hash_key(self, state: game.GameState, z_table: list) -> int:
+        """
+        Hashes the X and O pieces of a board.
+        :param state: state to hash
+        :param z_table: Zobrist hash table
+        :return: hash key
+        """
+        key = 0
+        for c, piece in enumerate(WindowIndex.of(state).flatten(state)):
+            if piece == game.X_PIECE:
+                key ^= z_table[c][0]
+            elif piece == game.O_PIECE:
+                key ^= z_table[c][1]
+        return key
+
+    def zobrist_table(self, size: int) -> list:
+        """
+        Returns the Zobrist hash table for boards with the given number of squares and the agent's seed, building it on
+        first use.
+        :param size: number of squares on the board
+        :return: list with an [X, O] pair of keys per square
+        """
+        key = (size, self.seed)
+        if key not in self.z_tables:
+            self.z_tables[key] = zobrist_table(size, self.seed)
+        return self.z_tables[key]
+
+    def legal_moves(self, state: game.GameState) -> list:
+        """
+        Lists every empty square on the board, in board order.
+        :param state: state to list moves for
+        :return: list of moves (i,j,k,x)
+        """
+        d = state.d
+        return [(i, j, k, x)
+                for i in range(d[0])
+                for j in range(d[1])
+                for k in range(d[2])
+                for x in range(d[3])
+                if state.board[i][j][k][x] == game.EMPTY_PIECE]
+
+    def live_moves(self, moves: list, windows: WindowIndex, x_counts: list, o_counts: list) -> list:
+        """
+        Drops the moves on squares that are only in dead windows. Playing such a square cannot help either player, so
+        it is the same as passing.
+        :param moves: list of moves (i,j,k,x)
+        :param windows: window index of the board
+        :param x_counts: X counts per window from WindowIndex.open_counts()
+        :param o_counts: O counts per window from WindowIndex.open_counts()
+        :return: list of moves in the same order
+        """
+        return [move for move in moves
+                if any(x_counts[w] >= 0 or o_counts[w] >= 0 for w in windows.cell_windows[windows.index(move)])]
+
+    def is_tactical(self, index: int, windows: WindowIndex, x_counts: list, o_counts: list) -> bool:
+        """
+        A move is tactical if it extends or blocks a window that either player could still complete and that already
+        holds at least k - 2 of their pieces, so that it creates or stops a (k-1)-in-window threat.
+        :param index: flat cell index of the move
+        :param windows: window index of the board
+        :param x_counts: X counts per window from WindowIndex.open_counts()
+        :param o_counts: O counts per window from WindowIndex.open_counts()
+        :return: True if tactical, False if quiet
+        """
+        threshold = windows.k - 2
+        for w in windows.cell_windows[index]:
+            if x_counts[w] >= threshold or o_counts[w] >= threshold:
+                return True
+        return False
+
+    def quiet_gain(self, index: int, piece: str, x_counts: list, o_counts: list, windows: WindowIndex) -> float:
+        """
+        How much playing a quiet move changes static_eval() in favour of the player making it. Each window through the
+        square either gains one of the mover's pieces or loses its value to the opponent.
+        :param index: flat cell index of the move
+        :param piece: piece of the player making the move
+        :param x_counts: X counts per window from WindowIndex.open_counts()
+        :param o_counts: O counts per window from WindowIndex.open_counts()
+        :param windows: window index of the board
+        :return: change in evaluation
+        """
+        weights = self.pattern_table(windows.k).weights
+        own_counts, other_counts = (x_counts, o_counts) if piece == game.X_PIECE else (o_counts, x_counts)
+        gain = 0
+        for w in windows.cell_windows[index]:
+            if own_counts[w] >= 0:
+                gain += weights[own_counts[w] + 1] - (weights[own_counts[w]] if own_counts[w] else 0)
+            if other_counts[w] > 0:
+                gain += weights[other_counts[w]]
+        return gain
+
+    def win_value(self, state: game.GameState) -> float:
+        """
+        Value of a won position. Wins found with more depth remaining (sooner) are scaled up by the search.
+        :param state: state being evaluated
+        :return: win value
+        """
+        return 10.0 ** (state.k + 5)
 
     def static_eval(self, state: game.GameState) -> float:
         """
         Evaluates the given state. States good for X should be larger that states good for O.
+        Every window that only one player has pieces in is scored from the pattern table for k.
         :param state: state to evaluate
         :return: evaluation of the state
         """
         self.eval_calls += 1
+        windows = WindowIndex.of(state)
+        return self.pattern_table(state.k).evaluate(windows.flatten(state), windows, self.win_value(state))
 
-        d = state.d
-
-        value = 0
-        win_value = 10.0 ** (state.k + 5)
-        x_value = 0
-        o_value = 0
-        x_wins = 0
-        o_wins = 0
-
-        for direction in state.directions:
-            for i in range(d[0]):
-                for j in range(d[1]):
-                    for k in range(d[2]):
-                        for x in range(d[3]):
-                            valid, steps = state.is_valid_starting_point((i, j, k, x), direction)
-                            if valid:
-                                # print((i, j, k, x, y), direction, steps)
-                                for step in range(steps):
-                                    x_pieces = 0
-                                    o_pieces = 0
-                                    x_blocked = False
-                                    o_blocked = False
-                                    for c in range(state.k):
-                                        p = (i + direction[0] * (step + c),
-                                             j + direction[1] * (step + c),
-                                             k + direction[2] * (step + c),
-                                             x + direction[3] * (step + c))
-                                        value = state.board[p[0]][p[1]][p[2]][p[3]]
-                                        if value == game.X_PIECE:
-                                            x_pieces += 1
-                                            o_blocked = True
-                                        elif value == game.O_PIECE:
-                                            o_pieces += 1
-                                            x_blocked = True
-                                        elif value == game.BLOCK_PIECE:
-                                            x_blocked = True
-                                            o_blocked = True
-
-                                    if not x_blocked:
-                                        if x_pieces == state.k:
-                                            return win_value
-                                        elif x_pieces != 0:
-                                            x_value += 10 ** x_pieces
-                                    if not o_blocked:
-                                        if o_pieces == state.k:
-                                            return -win_value
-                                        elif o_pieces != 0:
-                                            o_value += 10 ** o_pieces
-
-        return x_value - o_value
+    def pattern_table(self, k: int) -> PatternTable:
+        """
+        Returns the window score table for k, built from eval_weights on first use.
+        :param k: pieces in a row needed to win
+        :return: pattern table
+        """
+        if k not in self.pattern_tables:
+            weights = self.eval_weights.get(k) if self.eval_weights is not None else None
+            self.pattern_tables[k] = PatternTable(k, weights)
+        return self.pattern_tables[k]
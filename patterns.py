@@ -0,0 +1,94 @@
+"""
+patterns.py
+
+Lookup table of window scores for the static evaluation. Each window's contents are encoded as a small integer by
+adding up a code per square, so that scoring a window is a single table lookup instead of a loop over its squares.
+Tuned weights are kept in a JSON weight file mapping k to the list of weights, written by tune.py.
+"""
+import game
+import json
+import os
+from windows import WindowIndex
+
+
+class PatternTable:
+    """
+    Scores for every possible window content for one k. A window holding x X pieces, o O pieces and b blocks has code
+    x + o * (k + 1) + b * (k + 1) ** 2. A window with only X pieces scores weights[x], one with only O pieces scores
+    -weights[o], and every other window scores 0. The default weights are the powers of ten that static_eval() has
+    always used; tuned weights can be passed in instead.
+    """
+
+    def __init__(self, k: int, weights: list = None):
+        """
+        :param k: pieces in a row needed to win
+        :param weights: score of a window holding n pieces of one player and nothing else, for n in 0..k-1
+        """
+        if weights is None:
+            weights = [0] + [10 ** n for n in range(1, k)]
+        assert len(weights) == k, f"expected {k} weights, got {len(weights)}"
+        self.k = k
+        self.weights = list(weights)
+        self.cell_codes = {game.EMPTY_PIECE: 0, game.X_PIECE: 1, game.O_PIECE: k + 1, game.BLOCK_PIECE: (k + 1) ** 2}
+        self.x_win = k
+        self.o_win = k * (k + 1)
+
+        scores = [0] * (k * (k + 1) ** 2 + 1)
+        for pieces in range(1, k):
+            scores[pieces] = self.weights[pieces]
+            scores[pieces * (k + 1)] = -self.weights[pieces]
+        self.scores = scores
+
+    def window_codes(self, board: list, windows: WindowIndex) -> list:
+        """
+        Encodes every window on the board.
+        :param board: flat board from WindowIndex.flatten()
+        :param windows: window index of the board
+        :return: list of codes, indexed like windows
+        """
+        codes = [self.cell_codes[piece] for piece in board]
+        if self.k == 1:
+            return [codes[window[0]] for window in windows.windows]
+        return [sum(getter(codes)) for getter in windows.getters]
+
+    def evaluate(self, board: list, windows: WindowIndex, win_value: float) -> float:
+        """
+        Scores a board. A completed window scores win_value for X or -win_value for O, whichever comes first in window
+        order; otherwise the window scores are added up.
+        :param board: flat board from WindowIndex.flatten()
+        :param windows: window index of the board
+        :param win_value: value of a won position
+        :return: evaluation, larger is better for X
+        """
+        codes = self.window_codes(board, windows)
+        x_win = self.x_win in codes
+        o_win = self.o_win in codes
+        if x_win or o_win:
+            if not o_win or (x_win and codes.index(self.x_win) < codes.index(self.o_win)):
+                return win_value
+            return -win_value
+        return sum(map(self.scores.__getitem__, codes))
+
+
+def load_weights(filename: str) -> [dict, None]:
+    """
+    Reads a weight file.
+    :param filename: path of the weight file
+    :return: dict from k to weights, or None if the file does not exist
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as file:
+        return {int(k): weights for k, weights in json.load(file).items()}
+
+
+def save_weights(filename: str, weights: dict):
+    """
+    Writes a weight file, keeping the weights already in it for other values of k.
+    :param filename: path of the weight file
+    :param weights: dict from k to weights
+    """
+    all_weights = load_weights(filename) or dict()
+    all_weights.update(weights)
+    with open(filename, 'w') as file:
+        json.dump({str(k): list(all_weights[k]) for k in sorted(all_weights)}, file, indent=1)
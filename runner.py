@@ -14,6 +14,7 @@ import agent
 import transcript
 import random
 import sys
+import time
 
 
 class GameRunner:
@@ -22,13 +23,16 @@ class GameRunner:
     def __init__(self, x_agent: agent.Agent, o_agent: agent.Agent):
         self.agents = {game.X_PIECE: x_agent, game.O_PIECE: o_agent}
 
-    def run_game(self, initial_state: game.GameState, time_limit=None, silent=False, transcript_name=None):
+    def run_game(self, initial_state: game.GameState, time_limit=None, silent=False, transcript_name=None,
+                 record_name=None):
         """
         Runs a game between the two agents using the given starting state.
         :param initial_state: starting state
         :param time_limit: time (in seconds) given to each player for their move
         :param silent: True to suppress most console output
         :param transcript_name: name of file (without extension) to save game transcript to. None will not save anything
+        :param record_name: name of file (without extension) to stream the game record to as it is played. Defaults to
+            transcript_name. None with no transcript_name will not save anything
         :return: winner of the game ('X' or 'O')
         """
         state = initial_state.copy()
@@ -39,60 +43,78 @@ class GameRunner:
             def p(text=''):
                 print(text)
 
-        t = transcript.Transcript()
+        record_name = record_name or transcript_name
+        if record_name:
+            record = transcript.RecordWriter(record_name + '.jsonl', state, time_limit=time_limit,
+                                             players={piece: a.nickname() for piece, a in self.agents.items()})
+
+            def t(text, speaker='runner'):
+                record.comment(text, speaker)
+        else:
+            record = None
+
+            def t(text, speaker='runner'):
+                pass
+
+        """Agents that can play more than one game are told a new one is starting, so they keep their tables warm"""
+        for piece, a in self.agents.items():
+            if hasattr(a, 'new_game'):
+                a.new_game(state, piece)
 
         p("Players, introduce yourselves!\n"
           "==============================")
-        t.runner_comment("Players, introduce yourselves!")
+        t("Players, introduce yourselves!")
         for piece in self.agents.keys():
             p()
             p(f"Playing as {piece}:")
             p(self.agents[piece].introduce())
             p()
-            t.runner_comment(f"Playing as {piece}:")
-            t.player_comment(self.agents[piece].introduce(), piece)
+            t(f"Playing as {piece}:")
+            t(self.agents[piece].introduce(), piece)
         p(' vs '.join(a.nickname() for a in self.agents.values()))
-        t.runner_comment(' vs '.join(a.nickname() for a in self.agents.values()))
+        t(' vs '.join(a.nickname() for a in self.agents.values()))
         p("Let the game begin!")
-        t.runner_comment("Here is the starting board:")
-        # t.print_move(None, None, None, state)
-        t.runner_comment("Let the game begin!")
+        t("Let the game begin!")
 
         while not (winner := state.winner()):
             curr_agent = self.agents[state.next_player]
             piece = state.next_player
             try:
+                start = time.perf_counter()
                 move = curr_agent.get_move(state, time_limit)
                 if not state.is_valid_move(move):
                     raise ValueError
                 state = state.make_move(move)
-                # t.print_move(curr_agent.nickname(), piece, move, state)
+                if record:
+                    record.move(piece, move, time.perf_counter() - start)
                 p(state)
                 p()
             except TimeoutError:
                 print(f"player {curr_agent.nickname()} failed to return a move within the time limit")
-                t.runner_comment(f"player {curr_agent.nickname()} failed to return a move within the time limit")
+                t(f"player {curr_agent.nickname()} failed to return a move within the time limit")
                 winner = game.X_PIECE if piece == game.O_PIECE else game.O_PIECE
                 break
             except ValueError:
                 print(f"player {curr_agent.nickname()} did not return a valid move")
-                t.runner_comment(f"player {curr_agent.nickname()} did not return a valid move")
+                t(f"player {curr_agent.nickname()} did not return a valid move")
                 winner = game.X_PIECE if piece == game.O_PIECE else game.O_PIECE
                 break
             except:
                 print(f"exception during {curr_agent.nickname()}'s play")
-                t.runner_comment(f"exception during {curr_agent.nickname()}'s play")
+                t(f"exception during {curr_agent.nickname()}'s play")
                 winner = game.X_PIECE if piece == game.O_PIECE else game.O_PIECE
                 break
         if winner == "draw":
             print("Game ends in a draw!")
-            t.runner_comment("Game ends in a draw!")
+            t("Game ends in a draw!")
         else:
             print(f"Player {winner}, aka {self.agents[winner].nickname()} wins the game!")
-            t.runner_comment(f"Player {winner}, aka {self.agents[winner].nickname()} wins the game!")
+            t(f"Player {winner}, aka {self.agents[winner].nickname()} wins the game!")
 
+        if record:
+            record.finish(winner)
         if transcript_name:
-            t.generate(transcript_name, pdf=True)
+            transcript.render(record_name + '.jsonl', transcript_name, pdf=True)
 
         return winner
 
@@ -105,6 +127,8 @@ if __name__ == '__main__':
     
     Note: to generate pdf transcripts, you must run `pip install pyppeteer`. Otherwise an html transcript will be made.
     Remember to change the transcript name, otherwise your old transcript will be overwritten!
+    To only record the game, pass record_name instead of transcript_name, and render the record later with
+    python3 transcript.py out.jsonl --pdf
     """
     import minimax_agent
 
@@ -0,0 +1,318 @@
+"""
+selfplay.py
+
+Generates labelled training positions by letting MinimaxAgent play itself from randomised openings. Every position an
+agent searched is stored with the side to move, the search score and the final result of the game, in chunks of
+memory-mapped NumPy arrays that can be read back lazily. Positions are deduplicated by Zobrist key. Run this file to
+add games to a data directory:
+    python3 selfplay.py data --board empty --size 1 1 7 7 --k 5 --games 1000 --workers 4
+"""
+import argparse
+import contextlib
+import game
+import io
+import json
+import math
+import minimax_agent
+import numpy as np
+import os
+import random
+import runner
+import windows
+from concurrent.futures import ProcessPoolExecutor
+
+"""Codes for the pieces on a stored board, and for the side to move and the result of the game"""
+CELL_CODES = {game.EMPTY_PIECE: 0, game.X_PIECE: 1, game.O_PIECE: -1, game.BLOCK_PIECE: 2}
+SIDES = {game.X_PIECE: 1, game.O_PIECE: -1}
+RESULTS = {game.X_PIECE: 1, game.O_PIECE: -1, 'draw': 0}
+
+"""Seed of the Zobrist keys used for deduplication, fixed so that keys agree across runs and processes"""
+ZOBRIST_SEED = 415
+
+"""Agents of a worker process by piece, reused from game to game"""
+_agents = dict()
+
+
+def row_dtype(size: int) -> np.dtype:
+    """
+    Layout of one stored position.
+    :param size: number of squares on the board
+    :return: structured dtype with board, side, score (from X's perspective), result and key fields
+    """
+    return np.dtype([('board', 'i1', (size,)), ('side', 'i1'), ('score', 'f8'), ('result', 'i1'), ('key', 'u8')])
+
+
+def zobrist_table(size: int, seed: int = ZOBRIST_SEED) -> (list, int):
+    """
+    Builds 64 bit Zobrist keys for deduplication.
+    :param size: number of squares on the board
+    :param seed: random seed
+    :return: list with an [X, O, block] triple of keys per square, key for O to move
+    """
+    rng = random.Random(seed)
+    return [[rng.getrandbits(64) for _ in range(3)] for _ in range(size)], rng.getrandbits(64)
+
+
+def zobrist_key(board: list, side: int, z_table: list, z_side: int) -> int:
+    """
+    Hashes a stored board.
+    :param board: board as a list of CELL_CODES
+    :param side: side to move, from SIDES
+    :param z_table: keys per square from zobrist_table()
+    :param z_side: key for O to move from zobrist_table()
+    :return: 64 bit key
+    """
+    key = z_side if side == SIDES[game.O_PIECE] else 0
+    for c, code in enumerate(board):
+        if code == 1:
+            key ^= z_table[c][0]
+        elif code == -1:
+            key ^= z_table[c][1]
+        elif code == 2:
+            key ^= z_table[c][2]
+    return key
+
+
+class RecordingAgent(minimax_agent.MinimaxAgent):
+    """
+    MinimaxAgent that keeps every position it was asked to move in, along with its search score.
+    """
+
+    def __init__(self, initial_state: game.GameState, piece: str):
+        super().__init__(initial_state, piece)
+        self.silent = True
+        self.positions = []
+
+    def new_game(self, initial_state: game.GameState, piece: str = None):
+        super().new_game(initial_state, piece)
+        self.positions = []
+
+    def choose_move(self, state: game.GameState, time_limit: float) -> (int, int):
+        move = super().choose_move(state, time_limit)
+        if self.search_value is None:
+            score = math.nan
+        else:
+            score = self.search_value if state.next_player == game.X_PIECE else -self.search_value
+        board = [CELL_CODES[piece] for plane in state.board for grid in plane for row in grid for piece in row]
+        self.positions.append((board, SIDES[state.next_player], score))
+        return move
+
+
+def random_opening(state: game.GameState, moves: int, rng: random.Random) -> game.GameState:
+    """
+    Plays random moves from the given state, stopping early if the game ends.
+    :param state: starting state
+    :param moves: number of random moves
+    :param rng: random number generator
+    :return: state after the opening
+    """
+    d = state.d
+    for _ in range(moves):
+        empty = [(i, j, k, x) for i in range(d[0]) for j in range(d[1]) for k in range(d[2]) for x in range(d[3])
+                 if state.board[i][j][k][x] == game.EMPTY_PIECE]
+        if not empty or state.winner():
+            break
+        state = state.make_move(rng.choice(empty))
+    return state
+
+
+def play_game(initial_state: game.GameState, seed: int, opening_moves: int = 2, time_limit: float = None,
+              max_depth: int = 2, geometry: str = None) -> list:
+    """
+    Plays one self-play game. Runs in a worker process, where the agents are kept for the next game.
+    :param initial_state: starting state
+    :param seed: seed of the random opening
+    :param opening_moves: number of random moves played before the agents take over
+    :param time_limit: time (in seconds) per move. None searches every move to max_depth
+    :param max_depth: search depth of the agents
+    :param geometry: file from windows.save_geometry() for the agents to load when they are created, or None
+    :return: list of (board, side, score, result) rows
+    """
+    state = random_opening(initial_state, opening_moves, random.Random(seed))
+    for piece in SIDES:
+        if piece not in _agents:
+            _agents[piece] = RecordingAgent(state, piece)
+            if geometry is not None:
+                _agents[piece].load_geometry(geometry)
+    agents = {piece: _agents[piece] for piece in SIDES}
+    for a in agents.values():
+        a.max_depth = max_depth
+        a.new_game(state)
+    with contextlib.redirect_stdout(io.StringIO()):
+        winner = state.winner() or runner.GameRunner(agents[game.X_PIECE], agents[game.O_PIECE]).run_game(
+            state, time_limit=time_limit, silent=True)
+    result = RESULTS[winner]
+    return [(board, side, score, result) for a in agents.values() for board, side, score in a.positions]
+
+
+class PositionWriter:
+    """
+    Appends positions to a data directory of memory-mapped chunks chunk_00000.npy, chunk_00001.npy, ..., each holding
+    chunk_size rows of row_dtype(). meta.json records the board shape and the number of rows used in each chunk, and is
+    rewritten whenever a chunk fills up and on close(). Opening an existing directory continues where it left off.
+    """
+
+    def __init__(self, directory: str, state: game.GameState, chunk_size: int = 1 << 16):
+        """
+        :param directory: data directory, created if missing
+        :param state: any state with the board shape and k of the stored positions
+        :param chunk_size: rows per chunk
+        """
+        self.directory = directory
+        self.size = state.d[0] * state.d[1] * state.d[2] * state.d[3]
+        self.z_table, self.z_side = zobrist_table(self.size)
+        self.duplicates = 0
+        self.keys = set()
+        self.chunk = None
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            reader = PositionReader(directory)
+            assert reader.meta['d'] == list(state.d) and reader.meta['k'] == state.k, "board shape does not match"
+            self.meta = reader.meta
+            for chunk in reader.chunks():
+                self.keys.update(chunk['key'].tolist())
+        else:
+            self.meta = {'d': list(state.d), 'k': state.k, 'chunk_size': chunk_size, 'counts': []}
+
+    def add(self, board: list, side: int, score: float, result: int) -> bool:
+        """
+        Stores a position unless it is already stored.
+        :param board: board as a list of CELL_CODES
+        :param side: side to move, from SIDES
+        :param score: search score from X's perspective
+        :param result: result of the game, from RESULTS
+        :return: True if stored, False if it was a duplicate
+        """
+        key = zobrist_key(board, side, self.z_table, self.z_side)
+        if key in self.keys:
+            self.duplicates += 1
+            return False
+        self.keys.add(key)
+
+        counts = self.meta['counts']
+        if self.chunk is None or counts[-1] == self.meta['chunk_size']:
+            self.open_chunk()
+        self.chunk[counts[-1]] = (board, side, score, result, key)
+        counts[-1] += 1
+        return True
+
+    def open_chunk(self):
+        """
+        Opens the last chunk if it has room left, or starts a new one.
+        """
+        counts = self.meta['counts']
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.write_meta()
+        if counts and counts[-1] < self.meta['chunk_size']:
+            self.chunk = np.load(self.chunk_path(len(counts) - 1), mmap_mode='r+')
+        else:
+            counts.append(0)
+            self.chunk = np.lib.format.open_memmap(self.chunk_path(len(counts) - 1), mode='w+',
+                                                   dtype=row_dtype(self.size), shape=(self.meta['chunk_size'],))
+
+    def chunk_path(self, n: int) -> str:
+        return os.path.join(self.directory, f'chunk_{n:05d}.npy')
+
+    def write_meta(self):
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as file:
+            json.dump(self.meta, file)
+
+    def close(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+        self.write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PositionReader:
+    """
+    Reads a data directory written by PositionWriter. Chunks are memory-mapped, so only the parts that are used are
+    loaded into memory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+
+    def __len__(self):
+        return sum(self.meta['counts'])
+
+    def chunks(self):
+        """
+        Yields the used rows of every chunk as read-only memory-mapped arrays.
+        """
+        for n, count in enumerate(self.meta['counts']):
+            yield np.load(os.path.join(self.directory, f'chunk_{n:05d}.npy'), mmap_mode='r')[:count]
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+
+def generate(directory: str, initial_state: game.GameState, games: int, workers: int = None, opening_moves: int = 2,
+             time_limit: float = None, max_depth: int = 2, seed: int = 0, geometry: str = None) -> PositionWriter:
+    """
+    Plays self-play games on a process pool and stores their positions as the games finish.
+    :param directory: data directory
+    :param initial_state: starting state of every game
+    :param games: number of games
+    :param workers: number of worker processes. None uses every core
+    :param opening_moves: number of random moves at the start of each game
+    :param time_limit: time (in seconds) per move. None searches every move to max_depth
+    :param max_depth: search depth of the agents
+    :param seed: seed of the first game's opening, later games use the following seeds
+    :param geometry: file from windows.save_geometry() for the worker processes to load instead of building the window
+        index and Zobrist table themselves, or None
+    :return: the closed writer, with the stored keys and number of duplicates
+    """
+    with PositionWriter(directory, initial_state) as writer, ProcessPoolExecutor(workers) as pool:
+        n = range(games)
+        for rows in pool.map(play_game, [initial_state] * games, [seed + i for i in n], [opening_moves] * games,
+                             [time_limit] * games, [max_depth] * games, [geometry] * games):
+            for row in rows:
+                writer.add(*row)
+    return writer
+
+
+BOARDS = {
+    'tic_tac_toe': game.GameState.tic_tac_toe,
+    'no_corners': game.GameState.no_corners,
+    'no_corners_small': game.GameState.no_corners_small,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate training positions by self-play.")
+    parser.add_argument('directory', help="data directory to add positions to")
+    parser.add_argument('--board', choices=sorted(BOARDS) + ['empty'], default='empty', help="starting board")
+    parser.add_argument('--size', type=int, nargs=4, default=(1, 1, 7, 7), help="board size for an empty board")
+    parser.add_argument('--k', type=int, default=5, help="pieces in a row to win for an empty board")
+    parser.add_argument('--games', type=int, default=100, help="number of games")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument('--opening-moves', type=int, default=2, help="random moves at the start of each game")
+    parser.add_argument('--time-limit', type=float, default=None, help="time limit per move in seconds")
+    parser.add_argument('--max-depth', type=int, default=2, help="search depth of the agents")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first opening")
+    parser.add_argument('--geometry', default=None, help="window index file for the workers, written if missing")
+    args = parser.parse_args()
+
+    if args.board == 'empty':
+        s = game.GameState.empty(tuple(args.size), args.k)
+    else:
+        s = BOARDS[args.board]()
+
+    if args.geometry and not os.path.exists(args.geometry):
+        windows.save_geometry(args.geometry, s)
+    w = generate(args.directory, s, args.games, args.workers, args.opening_moves, args.time_limit, args.max_depth,
+                 args.seed, args.geometry)
+    print(f"{len(PositionReader(args.directory))} positions stored, {w.duplicates} duplicates skipped")
@@ -0,0 +1,259 @@
+"""
+server.py
+
+Asyncio server hosting many games against MinimaxAgent at once. Clients connect over TCP or a Unix socket and send one
+JSON object per line, and get one JSON object per line back:
+    {"op": "new_game", "board": "empty", "size": [1, 1, 7, 7], "k": 5, "move_time": 1.0, "time_budget": 30}
+    {"op": "play", "game": 1, "move": [0, 0, 3, 3]}    play a move, then the agent answers
+    {"op": "play", "game": 1}                          the agent moves for the side to move
+    {"op": "end_game", "game": 1}
+    {"op": "stats"}
+An "id" field in a request is copied into its response. The searches run on a shared process pool; each worker keeps
+one agent per board shape, k and piece across games. Run this file to start a server:
+    python3 server.py --port 4150 --workers 4
+"""
+import argparse
+import asyncio
+import game
+import json
+import minimax_agent
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from solver import BOARDS
+
+"""Agents of a worker process, by board shape, k and piece"""
+_agents = dict()
+
+
+def choose(board: list, next_player: str, k: int, time_limit: float, max_depth: int) -> tuple:
+    """
+    Chooses a move for the player to move. Runs in a worker process, reusing the agent for the board shape.
+    :param board: board of the position
+    :param next_player: player to move
+    :param k: pieces in a row needed to win
+    :param time_limit: time (in seconds) for the search
+    :param max_depth: search depth limit
+    :return: move (i,j,k,x), value for the player to move, depth reached, nodes searched
+    """
+    state = game.GameState(board, next_player, k)
+    key = (tuple(state.d), k, next_player)
+    if key not in _agents:
+        _agents[key] = minimax_agent.MinimaxAgent(state, next_player)
+        _agents[key].silent = True
+    a = _agents[key]
+    a.max_depth = max_depth
+    move = a.choose_move(state, time_limit)
+    return move, a.search_value, a.search_depth, a.search_nodes
+
+
+@dataclass
+class ServerGame:
+    """
+    A game hosted by the server. remaining is the time left of the agent's budget for the game, None if unbounded.
+    """
+    state: game.GameState
+    move_time: float
+    remaining: [float, None]
+    max_depth: int
+    winner: [str, None] = None
+    thinking: bool = False
+
+
+class GameServer:
+    """
+    Hosts games and runs the agent's searches on a process pool. At most one search per worker runs at a time; further
+    searches wait in a queue of at most max_queue, and requests beyond that are turned away with a "server busy" error.
+    Each connection is served one request at a time, so a client that sends faster than it is answered is slowed down by
+    the socket.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = 64, move_time: float = 1.0, max_depth: int = 3):
+        """
+        :param workers: number of worker processes. None uses every core
+        :param max_queue: maximum number of searches waiting for a worker
+        :param move_time: default time (in seconds) per agent move
+        :param max_depth: default search depth limit
+        """
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.max_queue = max_queue
+        self.move_time = move_time
+        self.max_depth = max_depth
+        self.games = dict()
+        self.next_game = 1
+
+        self.queued = 0
+        self.peak_queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.think_time = 0.0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves one connection until the client disconnects.
+        """
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                message = dict()
+                try:
+                    message = json.loads(line)
+                    response = await self.request(message)
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {'error': str(e) or type(e).__name__}
+                if isinstance(message, dict) and 'id' in message:
+                    response['id'] = message['id']
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def request(self, message: dict) -> dict:
+        """
+        Answers one request.
+        :param message: request
+        :return: response
+        """
+        op = message.get('op')
+        if op == 'new_game':
+            return self.new_game(message)
+        elif op == 'play':
+            return await self.play(self.games[message['game']], message.get('move'))
+        elif op == 'end_game':
+            self.games.pop(message['game'])
+            return {'game': message['game']}
+        elif op == 'stats':
+            return self.stats()
+        raise ValueError(f"unknown op {op}")
+
+    def new_game(self, message: dict) -> dict:
+        """
+        Starts a game from a named starting board, an empty board of the given size and k, or a board given in full.
+        """
+        board = message.get('board', 'empty')
+        if board == 'empty':
+            state = game.GameState.empty(tuple(message['size']), message['k'])
+        elif isinstance(board, str):
+            state = BOARDS[board]()
+        else:
+            state = game.GameState(board, message.get('next_player', game.X_PIECE), message['k'])
+        if 'next_player' in message:
+            state.next_player = message['next_player']
+
+        game_id = self.next_game
+        self.next_game += 1
+        self.games[game_id] = ServerGame(state, message.get('move_time', self.move_time), message.get('time_budget'),
+                                         message.get('max_depth', self.max_depth))
+        return {'game': game_id, 'board': state.board, 'next_player': state.next_player, 'k': state.k}
+
+    async def play(self, g: ServerGame, move: list = None) -> dict:
+        """
+        Plays the client's move if one is given, then the agent's move.
+        """
+        if g.winner:
+            raise ValueError(f"game is over, winner {g.winner}")
+        if g.thinking:
+            raise ValueError("agent is already thinking in this game")
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ValueError("server busy")
+        response = dict()
+        if move is not None:
+            move = tuple(move)
+            if not g.state.is_valid_move(move):
+                raise ValueError(f"invalid move {list(move)}")
+            g.state = g.state.make_move(move)
+            g.winner = g.state.winner()
+
+        if not g.winner:
+            move_time = g.move_time if g.remaining is None else min(g.move_time, g.remaining)
+            start = time.perf_counter()
+            g.thinking = True
+            try:
+                reply, value, depth, nodes = await self.search(g.state, move_time, g.max_depth)
+            finally:
+                g.thinking = False
+            if g.remaining is not None:
+                g.remaining -= time.perf_counter() - start
+            if g.remaining is not None and g.remaining < 0:
+                g.winner = game.X_PIECE if g.state.next_player == game.O_PIECE else game.O_PIECE
+            else:
+                g.state = g.state.make_move(reply)
+                g.winner = g.state.winner()
+                response.update(move=list(reply), value=value, depth=depth, nodes=nodes)
+
+        response.update(board=g.state.board, next_player=g.state.next_player, winner=g.winner, remaining=g.remaining)
+        return response
+
+    async def search(self, state: game.GameState, time_limit: float, max_depth: int) -> tuple:
+        """
+        Runs choose() on the pool once a worker is free, keeping the queueing metrics.
+        """
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        queued_at = time.perf_counter()
+        async with self.slots:
+            self.queued -= 1
+            self.running += 1
+            started_at = time.perf_counter()
+            self.wait_time += started_at - queued_at
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.pool, choose, state.board, state.next_player, state.k, time_limit, max_depth)
+            finally:
+                self.running -= 1
+                self.completed += 1
+                self.think_time += time.perf_counter() - started_at
+
+    def stats(self) -> dict:
+        """
+        Queueing metrics: searches waiting and running now, the longest queue so far, searches completed and turned
+        away, and the mean time a search waited for a worker and ran.
+        """
+        return {'games': len(self.games), 'workers': self.workers, 'queued': self.queued,
+                'peak_queued': self.peak_queued, 'running': self.running, 'completed': self.completed,
+                'rejected': self.rejected,
+                'mean_wait': self.wait_time / self.completed if self.completed else 0.0,
+                'mean_think': self.think_time / self.completed if self.completed else 0.0}
+
+    async def start(self, host: str = '127.0.0.1', port: int = 4150, path: str = None) -> asyncio.AbstractServer:
+        """
+        Starts listening on a TCP port, or on a Unix socket if a path is given.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def main(args):
+    s = GameServer(args.workers, args.max_queue, args.move_time, args.max_depth)
+    server = await s.start(args.host, args.port, args.unix)
+    print(f"serving on {args.unix or f'{args.host}:{args.port}'} with {s.workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        s.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Host games against the minimax agent.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=4150, help="TCP port to listen on")
+    parser.add_argument('--unix', default=None, help="Unix socket path to listen on instead of TCP")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument('--max-queue', type=int, default=64, help="searches that may wait for a worker")
+    parser.add_argument('--move-time', type=float, default=1.0, help="default time per move in seconds")
+    parser.add_argument('--max-depth', type=int, default=3, help="default search depth limit")
+    asyncio.run(main(parser.parse_args()))
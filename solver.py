@@ -0,0 +1,288 @@
+"""
+solver.py
+
+Depth-first proof-number (df-pn) search for solving positions: finds out whether the player to move wins, draws or
+loses with perfect play, along with a winning line. Run this file to solve one of the starting boards from game.py:
+    python3 solver.py no_corners_small
+    python3 solver.py empty --size 1 4 4 4 --k 4 --max-entries 1000000 --time-limit 600
+"""
+import argparse
+import game
+import time
+from dataclasses import dataclass
+from windows import WindowBoard
+
+"""Proof and disproof numbers at or above this are treated as infinite"""
+INFINITY = 10 ** 9
+
+
+@dataclass
+class Proof:
+    """
+    Result of solving a position. winner is the token of the player who wins with perfect play, 'draw', or None if the
+    position could not be solved within the node or time budget.
+    """
+    winner: [str, None]
+    line: list
+    nodes: int
+    seconds: float
+
+
+class ProofNumberSolver(WindowBoard):
+    """
+    Solves the position in the given state with df-pn. Proof and disproof numbers are kept in phi/delta form: phi is
+    the proof number for the player to move reaching their goal and delta the disproof number. The goal of the player
+    being proven to win is to complete a window, and the goal of their opponent is to stop them.
+    Positions are stored in a transposition table keyed by Zobrist hash. Passing max_entries bounds the table size;
+    when it fills up, the half of the entries with the smallest searched subtrees are dropped.
+    """
+
+    def __init__(self, state: game.GameState, max_entries: int = None, z_table: list = None):
+        """
+        :param state: state to solve
+        :param max_entries: maximum number of transposition table entries. None means unbounded
+        :param z_table: Zobrist hash table with an [X, O] pair of keys per square. zobrist_table() is used if None
+        """
+        super().__init__(state, z_table)
+        self.max_entries = max_entries
+        self.table = dict()
+        self.target = None
+        self.nodes = 0
+        self.max_nodes = None
+        self.timeout = None
+
+    def solve(self, max_nodes: int = None, time_limit: float = None) -> Proof:
+        """
+        Solves the position: first tries to prove a win for the player to move, then a win for their opponent. If
+        neither can win, the position is a draw.
+        :param max_nodes: node budget across both proofs. None means no limit
+        :param time_limit: time (in seconds) to give up after. None means no time limit
+        :return: proof result
+        """
+        start = time.perf_counter()
+        self.nodes = 0
+        self.max_nodes = max_nodes
+        self.timeout = start + time_limit if time_limit is not None else None
+
+        mover = self.next_player
+        other = game.O_PIECE if mover == game.X_PIECE else game.X_PIECE
+        winner = None
+        line = []
+        for target in (mover, other):
+            result = self.prove(target)
+            if result is None:
+                break
+            elif result:
+                winner = target
+                line = self.principal_line()
+                break
+        else:
+            winner = 'draw'
+
+        return Proof(winner, [self.windows.move(c) for c in line], self.nodes, time.perf_counter() - start)
+
+    def prove(self, target: str) -> [bool, None]:
+        """
+        Runs df-pn from the root to prove or disprove a win for the target player.
+        :param target: player to prove a win for
+        :return: True if proven, False if disproven, None if the budget ran out first
+        """
+        self.target = target
+        self.table = dict()
+        phi, delta = self.mid(self.next_player, INFINITY, INFINITY)
+        if phi == 0:
+            return self.next_player == target
+        elif delta == 0:
+            return self.next_player != target
+        return None
+
+    def mid(self, mover: str, phi_threshold: int, delta_threshold: int) -> (int, int):
+        """
+        Expands the current position until its phi or delta reaches the given threshold.
+        :param mover: player to move in the current position
+        :param phi_threshold: threshold for phi
+        :param delta_threshold: threshold for delta
+        :return: phi, delta of the current position
+        """
+        self.nodes += 1
+        key = self.z_key
+        start_nodes = self.nodes
+        other = game.O_PIECE if mover == game.X_PIECE else game.X_PIECE
+
+        value, cells = self.expand(mover)
+        if value is not None:
+            self.store(key, value[0], value[1], 1)
+            return value
+
+        while True:
+            """phi is the smallest child delta, delta is the sum of the child phis"""
+            phi = INFINITY
+            delta = 0
+            best = None
+            best_delta = INFINITY
+            second_delta = INFINITY
+            for c in cells:
+                child_phi, child_delta, _ = self.child_value(c, mover)
+                delta = min(delta + child_phi, INFINITY)
+                if child_delta < best_delta:
+                    second_delta = best_delta
+                    best_delta = child_delta
+                    best = c
+                elif child_delta < second_delta:
+                    second_delta = child_delta
+            phi = best_delta
+
+            if phi >= phi_threshold or delta >= delta_threshold or self.out_of_budget():
+                break
+
+            """Expand the most proving child until it stops being the best or the thresholds are reached"""
+            child_phi, child_delta, _ = self.child_value(best, mover)
+            child_phi_threshold = min(delta_threshold - delta + child_phi, INFINITY)
+            child_delta_threshold = min(phi_threshold, second_delta + 1)
+            self.play(best, mover)
+            self.mid(other, child_phi_threshold, child_delta_threshold)
+            self.unplay(best, mover)
+
+        self.store(key, phi, delta, self.nodes - start_nodes + 1)
+        return phi, delta
+
+    def expand(self, mover: str) -> (tuple, list):
+        """
+        Lists the moves worth trying in the current position, and decides the position outright where possible: a player
+        with a square that completes a window wins, a player facing two such squares loses, and the position is drawn
+        once the target has no window left to complete. Only the block is tried when facing one such square.
+        :param mover: player to move
+        :return: (phi, delta) if the position is decided, otherwise None, and the list of moves as flat cell indices
+        """
+        other = game.O_PIECE if mover == game.X_PIECE else game.X_PIECE
+        all_windows = range(len(self.windows.windows))
+
+        wins = self.threat_squares(mover, all_windows)
+        if wins:
+            return (0, INFINITY), [min(wins)]
+        losses = self.threat_squares(other, all_windows)
+        if len(losses) > 1:
+            return (INFINITY, 0), sorted(losses)
+        elif losses:
+            return None, list(losses)
+
+        cells = [c for c in range(self.windows.size) if self.board[c] == game.EMPTY_PIECE]
+        if not cells or not self.can_win(self.target):
+            return self.draw_value(mover), cells
+        return None, cells
+
+    def can_win(self, piece: str) -> bool:
+        """
+        Checks whether the given player still has a window free of the other player's pieces and of blocks.
+        """
+        other = self.counts[game.O_PIECE if piece == game.X_PIECE else game.X_PIECE]
+        for w in range(len(self.windows.windows)):
+            if other[w] == 0 and not self.blocked[w]:
+                return True
+        return False
+
+    def child_value(self, c: int, mover: str, solve_missing: bool = False) -> (int, int, int):
+        """
+        Looks up phi, delta and subtree size of the position after the mover plays on square c.
+        :param c: flat cell index of the move
+        :param mover: player making the move
+        :param solve_missing: True to search the position again if it is not in the transposition table
+        :return: phi, delta, work, from the perspective of the player to move after the move
+        """
+        other = game.O_PIECE if mover == game.X_PIECE else game.X_PIECE
+        self.play(c, mover)
+        if self.completes(c, mover):
+            value = (INFINITY, 0, 0)
+        elif self.empty == 0:
+            value = self.draw_value(other) + (0,)
+        elif self.z_key in self.table:
+            value = self.table[self.z_key]
+        elif solve_missing:
+            value = self.mid(other, INFINITY, INFINITY) + (0,)
+        else:
+            value = (1, 1, 0)
+        self.unplay(c, mover)
+        return value
+
+    def draw_value(self, mover: str) -> (int, int):
+        """
+        A draw meets the goal of the player defending against the target, and fails the target.
+        """
+        return (INFINITY, 0) if mover == self.target else (0, INFINITY)
+
+    def store(self, key: int, phi: int, delta: int, work: int):
+        """
+        Stores a position in the transposition table, dropping the smaller half of the table if it is full.
+        """
+        self.table[key] = (phi, delta, work)
+        if self.max_entries is not None and len(self.table) > self.max_entries:
+            keep = sorted(self.table.items(), key=lambda item: item[1][2], reverse=True)[:self.max_entries // 2]
+            self.table = dict(keep)
+
+    def out_of_budget(self) -> bool:
+        return ((self.max_nodes is not None and self.nodes >= self.max_nodes) or
+                (self.timeout is not None and time.perf_counter() > self.timeout))
+
+    def principal_line(self) -> list:
+        """
+        Follows a proven position from the root to the end of the game. The target plays a move that wins, and the
+        defender the move that holds out the longest.
+        :return: list of flat cell indices
+        """
+        line = []
+        mover = self.next_player
+        while True:
+            value, cells = self.expand(mover)
+            if not cells:
+                break
+            if value is not None:
+                c = cells[0]
+            else:
+                children = [(c,) + self.child_value(c, mover, solve_missing=True) for c in cells]
+                if mover == self.target:
+                    c = next(c for c, child_phi, child_delta, work in children if child_delta == 0)
+                else:
+                    c = max(children, key=lambda child: (child[1] == 0, child[3]))[0]
+            self.play(c, mover)
+            line.append(c)
+            if self.completes(c, mover):
+                break
+            mover = game.O_PIECE if mover == game.X_PIECE else game.X_PIECE
+
+        for n in reversed(range(len(line))):
+            self.unplay(line[n], self.next_player if n % 2 == 0 else
+                        (game.O_PIECE if self.next_player == game.X_PIECE else game.X_PIECE))
+        return line
+
+
+BOARDS = {
+    'tic_tac_toe': game.GameState.tic_tac_toe,
+    'no_corners': game.GameState.no_corners,
+    'no_corners_small': game.GameState.no_corners_small,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve a k-in-a-row position with proof-number search.")
+    parser.add_argument('board', choices=sorted(BOARDS) + ['empty'], help="starting board from game.py")
+    parser.add_argument('--size', type=int, nargs=4, default=(1, 1, 3, 3), help="board size for an empty board")
+    parser.add_argument('--k', type=int, default=3, help="pieces in a row to win for an empty board")
+    parser.add_argument('--max-nodes', type=int, default=None, help="node budget")
+    parser.add_argument('--time-limit', type=float, default=None, help="time limit in seconds")
+    parser.add_argument('--max-entries', type=int, default=None, help="bound on transposition table entries")
+    args = parser.parse_args()
+
+    if args.board == 'empty':
+        s = game.GameState.empty(tuple(args.size), args.k)
+    else:
+        s = BOARDS[args.board]()
+
+    proof = ProofNumberSolver(s, args.max_entries).solve(args.max_nodes, args.time_limit)
+    if proof.winner is None:
+        print(f"Unsolved after {proof.nodes} nodes and {round(proof.seconds, 2)} seconds")
+    elif proof.winner == 'draw':
+        print(f"Draw with perfect play, proven in {proof.nodes} nodes and {round(proof.seconds, 2)} seconds")
+    else:
+        print(f"{proof.winner} wins with perfect play, proven in {proof.nodes} nodes and {round(proof.seconds, 2)} "
+              f"seconds")
+        print(f"Winning line: {proof.line}")
@@ -0,0 +1,113 @@
+"""
+threats.py
+
+Threat-space search for forced wins. Looks only at moves that create a (k-1)-in-window threat, which the opponent
+has to answer by blocking the one square that completes it. This victory by continuous threats (VCF) search reaches
+far deeper than a full-width search because every defending move is forced.
+"""
+import game
+import time
+from windows import WindowBoard
+
+
+class ThreatSearch(WindowBoard):
+    """
+    Searches for a forced win for the player to move in the given state, making and unmaking moves on a WindowBoard.
+    """
+
+    def __init__(self, state: game.GameState, z_table: list = None):
+        """
+        :param state: state to search from
+        :param z_table: Zobrist hash table with an [X, O] pair of keys per square. zobrist_table() is used if None
+        """
+        super().__init__(state, z_table)
+        self.attacker = state.next_player
+        self.defender = game.O_PIECE if self.attacker == game.X_PIECE else game.X_PIECE
+        self.nodes = 0
+        self.max_nodes = None
+        self.failed = dict()
+
+    def find_win(self, max_depth: int = 8, timeout: float = None, max_nodes: int = None) -> [list, None]:
+        """
+        Searches for a sequence of threats that wins by force for the player to move.
+        :param max_depth: maximum number of threats the attacker may play
+        :param timeout: time.perf_counter() value to give up at. None means no time limit
+        :param max_nodes: node budget to give up after. None means no limit
+        :return: winning line as a list of moves (i,j,k,x) alternating attacker and defender, or None if none was found
+        """
+        a, d = self.attacker, self.defender
+        self.max_nodes = max_nodes
+
+        """A threat that is already on the board wins immediately"""
+        wins = self.threat_squares(a, range(len(self.windows.windows)))
+        if wins:
+            return [self.windows.move(min(wins))]
+
+        line = self.attack(self.threat_squares(d, range(len(self.windows.windows))), max_depth, timeout)
+        return None if line is None else [self.windows.move(c) for c in line]
+
+    def attack(self, defender_threats: set, depth: int, timeout: float) -> [list, None]:
+        """
+        Tries every threat for the attacker, answering each with the defender's forced block.
+        :param defender_threats: squares where the defender could complete a window on their next move
+        :param depth: number of threats the attacker may still play
+        :param timeout: time.perf_counter() value to give up at. None means no time limit
+        :return: winning line as a list of flat cell indices, or None
+        """
+        if depth == 0 or self.out_of_budget(timeout):
+            return None
+        if self.failed.get(self.z_key, -1) >= depth:
+            return None
+        self.nodes += 1
+        a, d = self.attacker, self.defender
+
+        if len(defender_threats) > 1:
+            """The defender has two ways to win, so the attacker cannot keep forcing"""
+            return None
+        elif defender_threats:
+            """The attacker must block, and the block only helps if it is also a threat"""
+            candidates = [c for c in defender_threats if c in self.threat_moves(a)]
+        else:
+            candidates = self.threat_moves(a)
+
+        for c in candidates:
+            self.play(c, a)
+            wins = self.threat_squares(a, self.windows.cell_windows[c])
+            if len(wins) > 1:
+                """Two threats at once, the defender can only block one of them"""
+                self.unplay(c, a)
+                first, second = sorted(wins)[:2]
+                return [c, first, second]
+
+            block = wins.pop()
+            self.play(block, d)
+            line = self.attack(self.threat_squares(d, self.windows.cell_windows[block]), depth - 1, timeout)
+            self.unplay(block, d)
+            self.unplay(c, a)
+            if line is not None:
+                return [c, block] + line
+
+        if not self.out_of_budget(timeout):
+            self.failed[self.z_key] = depth
+        return None
+
+    def out_of_budget(self, timeout: float) -> bool:
+        return ((self.max_nodes is not None and self.nodes >= self.max_nodes) or
+                (timeout is not None and time.perf_counter() > timeout))
+
+    def threat_moves(self, piece: str) -> list:
+        """
+        Lists the empty squares where the given player would create a (k-1)-in-window threat, squares that create
+        several threats at once first.
+        :param piece: player making the threat
+        :return: list of flat cell indices
+        """
+        own = self.counts[piece]
+        other = self.counts[game.O_PIECE if piece == game.X_PIECE else game.X_PIECE]
+        threats = dict()
+        for w, window in enumerate(self.windows.windows):
+            if own[w] == self.k - 2 and other[w] == 0 and not self.blocked[w]:
+                for c in window:
+                    if self.board[c] == game.EMPTY_PIECE:
+                        threats[c] = threats.get(c, 0) + 1
+        return sorted(threats, key=lambda c: (-threats[c], c))
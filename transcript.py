@@ -3,11 +3,20 @@ transcript.py
 author: CSE 415 course staff
 
 This file generates a file transcript of your game. You do not need to read or understand this file.
-You should not modify this file.
+
+While a game is played, RecordWriter streams a game record to disk: a JSON Lines file holding a header with the
+starting state and players, then one line per move or comment as it happens, then the result. Turning a record into
+an HTML or PDF transcript is a separate, offline step:
+    python3 transcript.py out.jsonl --pdf
 """
 
+import argparse
 import game
+import json
+import time
 
+"""Version of the game record format, written in every record header"""
+RECORD_VERSION = 1
 
 CLASSES = {'X': 'x-text', 'O': 'o-text', 'runner': 'runner-text'}
 TOKENS = {'X': '<span class="x-token">X</span>',
@@ -16,48 +25,48 @@ TOKENS = {'X': '<span class="x-token">X</span>',
 
 
 class Transcript:
-    _data: str
+    _data: list
 
     def __init__(self):
-        self._data = '<html><head><title>K-in-a-Row game</title>'
-        self._data += '<style>'
-        self._data += ('.runner-text:after { content: \'\'; position: absolute; bottom: 0; left: 50%; width: 0; '
-                       'height: 0; border: 10px solid transparent; border-top-color: gray; border-bottom: 0; '
-                       'border-left: 0; margin-left: -10px; margin-bottom: -10px; }')
-        self._data += ('.runner-text { position: relative; border: 2px solid gray; border-radius: 0.4em; '
-                       'width: fit-content; margin: 0 auto 12 auto; padding: 5; }')
-        self._data += ('.x-text:after { content: \'\'; position: absolute; bottom: 0; left: 25%; width: 0; height: 0; '
-                       'border: 10px solid transparent; border-top-color: blue; border-bottom: 0; border-right: 0; '
-                       'margin-left: -10px; margin-bottom: -10px; }')
-        self._data += ('.x-text { position: relative; border: 2px solid blue; border-radius: 0.4em; '
-                       'width: fit-content; margin: 0 auto 12 0;  padding: 5;}')
-        self._data += ('.o-text:after { content: \'\'; position: absolute; bottom: 0; left: 75%; width: 0; height: 0; '
-                       'border: 10px solid transparent; border-top-color: red; border-bottom: 0; border-left: 0; '
-                       'margin-left: -10px; margin-bottom: -10px; }')
-        self._data += ('.o-text { position: relative; border: 2px solid red; border-radius: 0.4em; width: fit-content; '
-                       'margin: 0 0 12 auto; padding: 5; }')
-        self._data += '.main { margin: 0 auto; width: fit-content; }'
-        self._data += 'table { border-collapse: collapse; width: fit-content; margin: 0 auto;}'
-        self._data += 'tr td { border: 2px solid black; width: 25; height: 25; text-align: center; }'
-        self._data += '.o-token { color: red; font-family: Arial, sans-serif; font-weight: bold; }'
-        self._data += '.x-token { color: blue; font-family: Arial, sans-serif; font-weight: bold; }'
-        self._data += '.brick-token { color: black; font-family: Arial, sans-serif; font-weight: bold; }'
-        self._data += '</style>'
-        self._data += '</head><body><div class="main">'
+        self._data = ['<html><head><title>K-in-a-Row game</title>']
+        self._data.append('<style>')
+        self._data.append('.runner-text:after { content: \'\'; position: absolute; bottom: 0; left: 50%; width: 0; '
+                          'height: 0; border: 10px solid transparent; border-top-color: gray; border-bottom: 0; '
+                          'border-left: 0; margin-left: -10px; margin-bottom: -10px; }')
+        self._data.append('.runner-text { position: relative; border: 2px solid gray; border-radius: 0.4em; '
+                          'width: fit-content; margin: 0 auto 12 auto; padding: 5; }')
+        self._data.append('.x-text:after { content: \'\'; position: absolute; bottom: 0; left: 25%; width: 0; '
+                          'height: 0; border: 10px solid transparent; border-top-color: blue; border-bottom: 0; '
+                          'border-right: 0; margin-left: -10px; margin-bottom: -10px; }')
+        self._data.append('.x-text { position: relative; border: 2px solid blue; border-radius: 0.4em; '
+                          'width: fit-content; margin: 0 auto 12 0;  padding: 5;}')
+        self._data.append('.o-text:after { content: \'\'; position: absolute; bottom: 0; left: 75%; width: 0; '
+                          'height: 0; border: 10px solid transparent; border-top-color: red; border-bottom: 0; '
+                          'border-left: 0; margin-left: -10px; margin-bottom: -10px; }')
+        self._data.append('.o-text { position: relative; border: 2px solid red; border-radius: 0.4em; '
+                          'width: fit-content; margin: 0 0 12 auto; padding: 5; }')
+        self._data.append('.main { margin: 0 auto; width: fit-content; }')
+        self._data.append('table { border-collapse: collapse; width: fit-content; margin: 0 auto;}')
+        self._data.append('tr td { border: 2px solid black; width: 25; height: 25; text-align: center; }')
+        self._data.append('.o-token { color: red; font-family: Arial, sans-serif; font-weight: bold; }')
+        self._data.append('.x-token { color: blue; font-family: Arial, sans-serif; font-weight: bold; }')
+        self._data.append('.brick-token { color: black; font-family: Arial, sans-serif; font-weight: bold; }')
+        self._data.append('</style>')
+        self._data.append('</head><body><div class="main">')
         pass
 
     def _add_p(self, t: str, c: str):
         t = t.replace("\n", "<br/>")
-        self._data += f'<p class="{CLASSES[c] if c else ""}">{t}</p>'
+        self._data.append(f'<p class="{CLASSES[c] if c else ""}">{t}</p>')
 
     def start_game(self, xi, xn, oi, on):
-        self._data += f'<p class="{CLASSES["runner"]}">Players, introduce yourselves!</p>'
+        self._data.append(f'<p class="{CLASSES["runner"]}">Players, introduce yourselves!</p>')
         self._add_p("Players, introduce yourselves!", "runner")
-        self._data += f'<p class="{CLASSES["runner"]}">Playing as X:</p>'
-        self._data += f'<p class="{CLASSES["X"]}"></p>'
-        self._data += f'<p class="{CLASSES["X"]}"></p>'
+        self._data.append(f'<p class="{CLASSES["runner"]}">Playing as X:</p>')
+        self._data.append(f'<p class="{CLASSES["X"]}"></p>')
+        self._data.append(f'<p class="{CLASSES["X"]}"></p>')
 
-        self._data += f'<p class="{CLASSES["runner"]}">Playing as O:</p>'
+        self._data.append(f'<p class="{CLASSES["runner"]}">Playing as O:</p>')
 
         pass
 
@@ -65,17 +74,18 @@ class Transcript:
         if player:
             self._add_p(f'{player} plays {move}', token)
 
-        self._data += '<table>'
-
-        for row in state.board:
-            self._data += '<tr>'
-            for col in row:
-                self._data += '<td>'
-                if not col.isspace():
-                    self._data += TOKENS[col]
-                self._data += '</td>'
-            self._data += '</tr>'
-        self._data += '</table><br>'
+        for plane in state.board:
+            for grid in plane:
+                self._data.append('<table>')
+                for row in grid:
+                    self._data.append('<tr>')
+                    for col in row:
+                        self._data.append('<td>')
+                        if not col.isspace():
+                            self._data.append(TOKENS[col])
+                        self._data.append('</td>')
+                    self._data.append('</tr>')
+                self._data.append('</table><br>')
 
     def runner_comment(self, text):
         self._add_p(text, "runner")
@@ -84,7 +94,8 @@ class Transcript:
         self._add_p(text, player)
 
     def generate(self, filename, pdf=False):
-        self._data += '</div></body></html>'
+        self._data.append('</div></body></html>')
+        content = ''.join(self._data)
         error = False
         if pdf:
             try:
@@ -101,11 +112,146 @@ class Transcript:
                     await browser.close()
 
                 try:
-                    asyncio.get_event_loop().run_until_complete(gen_pdf(self._data, filename + '.pdf'))
+                    asyncio.get_event_loop().run_until_complete(gen_pdf(content, filename + '.pdf'))
                     print(f'transcript written to {filename}.pdf')
                 except:
                     error = True
         if not pdf or error:
             with open(filename + '.html', 'w') as file:
-                file.write(self._data)
+                file.write(content)
                 print(f'transcript written to {filename}.html')
+
+
+class RecordWriter:
+    """
+    Streams a game record to a JSON Lines file. The first line is the header, every later line is one event:
+        {"board": [...], "next_player": "X", "k": 4, "players": {"X": "...", "O": "..."}, "time_limit": 15, ...}
+        {"player": "X", "move": [0, 0, 2, 3], "seconds": 0.41}
+        {"player": "runner", "comment": "Let the game begin!"}
+        {"winner": "X"}
+    Each line is flushed as soon as it is written, so an interrupted game still leaves a readable record.
+    """
+
+    def __init__(self, filename: str, initial_state: game.GameState, **metadata):
+        """
+        Opens the record file and writes the header.
+        :param filename: path of the record file, usually ending in .jsonl
+        :param initial_state: starting state of the game
+        :param metadata: extra header fields, such as players or time_limit
+        """
+        self.filename = filename
+        self._file = open(filename, 'w')
+        header = {'version': RECORD_VERSION, 'board': initial_state.board, 'next_player': initial_state.next_player,
+                  'k': initial_state.k, 'started': time.time()}
+        header.update(metadata)
+        self._write(header)
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def move(self, player: str, move: (int, int, int, int), seconds: float = None):
+        """
+        Records a move.
+        :param player: piece of the player making the move
+        :param move: move (i,j,k,x)
+        :param seconds: time the player took to choose the move
+        """
+        entry = {'player': player, 'move': list(move)}
+        if seconds is not None:
+            entry['seconds'] = round(seconds, 4)
+        self._write(entry)
+
+    def comment(self, text: str, speaker: str = 'runner'):
+        """
+        Records a comment.
+        :param text: comment text
+        :param speaker: 'runner', or the piece of the player making the comment
+        """
+        self._write({'player': speaker, 'comment': text})
+
+    def finish(self, winner: str):
+        """
+        Records the result and closes the file.
+        :param winner: token of the winning player or 'draw'
+        """
+        self._write({'winner': winner})
+        self.close()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_record(filename: str) -> (dict, list):
+    """
+    Reads a game record written by RecordWriter.
+    :param filename: path of the record file
+    :return: header, list of events in the order they happened
+    """
+    with open(filename) as file:
+        header = json.loads(file.readline())
+        events = [json.loads(line) for line in file if line.strip()]
+    return header, events
+
+
+def replay(filename: str) -> list:
+    """
+    Replays the moves of a game record.
+    :param filename: path of the record file
+    :return: list of states, starting with the initial state and followed by the state after each move
+    """
+    header, events = read_record(filename)
+    state = game.GameState(header['board'], header['next_player'], header['k'])
+    states = [state]
+    for event in events:
+        if 'move' in event:
+            state = state.make_move(tuple(event['move']))
+            states.append(state)
+    return states
+
+
+def render(filename: str, output: str = None, pdf: bool = False):
+    """
+    Renders a game record as an HTML or PDF transcript.
+    :param filename: path of the record file
+    :param output: name of the transcript file (without extension). Defaults to the record name without its extension
+    :param pdf: True to make a PDF (needs pyppeteer), False for HTML
+    """
+    header, events = read_record(filename)
+    state = game.GameState(header['board'], header['next_player'], header['k'])
+    players = header.get('players', {})
+
+    t = Transcript()
+    t.runner_comment("Here is the starting board:")
+    t.print_move(None, None, None, state)
+    for event in events:
+        if 'move' in event:
+            move = tuple(event['move'])
+            state = state.make_move(move)
+            t.print_move(players.get(event['player'], event['player']), event['player'], move, state)
+        elif 'comment' in event:
+            if event['player'] == 'runner':
+                t.runner_comment(event['comment'])
+            else:
+                t.player_comment(event['comment'], event['player'])
+
+    if output is None:
+        output = filename[:-len('.jsonl')] if filename.endswith('.jsonl') else filename
+    t.generate(output, pdf=pdf)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render game records as HTML or PDF transcripts.")
+    parser.add_argument('records', nargs='+', help="game record files written by RecordWriter")
+    parser.add_argument('--pdf', action='store_true', help="make PDF transcripts (needs pyppeteer)")
+    args = parser.parse_args()
+
+    for record in args.records:
+        render(record, pdf=args.pdf)
@@ -0,0 +1,192 @@
+"""
+tune.py
+
+Texel tuning of the window pattern weights used by MinimaxAgent.static_eval(). The evaluation of each stored position
+is a weighted sum of its window counts, sigmoid(scale * evaluation) is read as the probability that X wins, and the
+weights are fitted to the results of self-play games from selfplay.py by minimising the mean squared error. The loss and
+its gradient are computed with NumPy over shards of the data set, one shard per worker process. Run this file to tune
+the weights for a data directory and write them to the weight file that MinimaxAgent loads at startup:
+    python3 tune.py data --iterations 200 --workers 4
+"""
+import argparse
+import game
+import minimax_agent
+import numpy as np
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from patterns import PatternTable, save_weights
+from selfplay import CELL_CODES, PositionReader
+from windows import WindowIndex
+
+
+def window_features(boards: np.ndarray, windows: np.ndarray, k: int) -> (np.ndarray, np.ndarray):
+    """
+    Counts the windows holding n pieces of only one player, for n in 1..k-1, as X's windows minus O's windows. The
+    static evaluation of a position is the dot product of these counts with weights[1:].
+    :param boards: (positions, squares) array of CELL_CODES
+    :param windows: (windows, k) array of flat cell indices
+    :param k: pieces in a row needed to win
+    :return: (positions, k-1) feature array, and a mask of the positions where no window is complete
+    """
+    cells = boards[:, windows]
+    x = (cells == CELL_CODES[game.X_PIECE]).sum(axis=2)
+    o = (cells == CELL_CODES[game.O_PIECE]).sum(axis=2)
+    open_ = (cells != CELL_CODES[game.BLOCK_PIECE]).all(axis=2)
+    x_only = np.where(open_ & (o == 0), x, 0)
+    o_only = np.where(open_ & (x == 0), o, 0)
+    features = np.stack([(x_only == n).sum(axis=1) - (o_only == n).sum(axis=1) for n in range(1, k)], axis=1)
+    undecided = ~((x == k) | (o == k)).any(axis=1)
+    return features.astype(np.float64), undecided
+
+
+def shard_loss(features_path: str, targets_path: str, start: int, end: int, weights: np.ndarray, scale: float,
+               gradient: bool = True) -> (float, np.ndarray):
+    """
+    Sums the squared error and its gradient over one shard of the data set. Runs in a worker process.
+    :param features_path: .npy file of window features
+    :param targets_path: .npy file of targets, 1 for an X win, 0 for an O win and 0.5 for a draw
+    :param start: first row of the shard
+    :param end: row after the last row of the shard
+    :param weights: weights[1:] of the pattern table
+    :param scale: sigmoid scale
+    :param gradient: False to skip the gradient
+    :return: sum of squared errors, gradient of the sum with respect to the weights (or None)
+    """
+    features = np.load(features_path, mmap_mode='r')[start:end]
+    targets = np.load(targets_path, mmap_mode='r')[start:end]
+    predictions = 1 / (1 + np.exp(-np.clip(scale * (features @ weights), -500, 500)))
+    errors = predictions - targets
+    loss = float(errors @ errors)
+    if not gradient:
+        return loss, None
+    return loss, features.T @ (2 * errors * predictions * (1 - predictions) * scale)
+
+
+class TexelTuner:
+    """
+    Fits pattern weights to the positions in a self-play data directory. The window features of every position are
+    extracted once into memory-mapped arrays in a work directory, which the worker processes read their shards from.
+    """
+
+    def __init__(self, directory: str, work_dir: str, workers: int = None, batch_size: int = 4096):
+        """
+        :param directory: data directory written by selfplay.py
+        :param work_dir: directory for the feature arrays
+        :param workers: number of worker processes. None uses every core
+        :param batch_size: positions per feature extraction batch
+        """
+        reader = PositionReader(directory)
+        self.k = reader.meta['k']
+        windows = WindowIndex.of(game.GameState.empty(tuple(reader.meta['d']), self.k))
+        window_array = np.array(windows.windows, dtype=np.intp)
+        self.workers = workers or os.cpu_count()
+
+        self.features_path = os.path.join(work_dir, 'features.npy')
+        self.targets_path = os.path.join(work_dir, 'targets.npy')
+        features = np.lib.format.open_memmap(self.features_path, mode='w+', dtype=np.float64,
+                                             shape=(max(len(reader), 1), self.k - 1))
+        targets = np.lib.format.open_memmap(self.targets_path, mode='w+', dtype=np.float64,
+                                            shape=(max(len(reader), 1),))
+        n = 0
+        for chunk in reader.chunks():
+            for start in range(0, len(chunk), batch_size):
+                rows = chunk[start:start + batch_size]
+                batch, undecided = window_features(rows['board'], window_array, self.k)
+                used = int(undecided.sum())
+                features[n:n + used] = batch[undecided]
+                targets[n:n + used] = (rows['result'][undecided] + 1) / 2
+                n += used
+        features.flush()
+        targets.flush()
+        self.positions = n
+
+        step = -(-n // self.workers) if n else 1
+        self.shards = [(start, min(start + step, n)) for start in range(0, n, step)]
+        self.scale = None
+
+    def loss(self, pool: ProcessPoolExecutor, weights: np.ndarray, scale: float,
+             gradient: bool = True) -> (float, np.ndarray):
+        """
+        Mean squared error of the data set and its gradient, summed over the shards on the worker pool.
+        :param pool: worker pool
+        :param weights: weights[1:] of the pattern table
+        :param scale: sigmoid scale
+        :param gradient: False to skip the gradient
+        :return: loss, gradient with respect to the weights (or None)
+        """
+        n = len(self.shards)
+        results = list(pool.map(shard_loss, [self.features_path] * n, [self.targets_path] * n,
+                                 [start for start, _ in self.shards], [end for _, end in self.shards],
+                                 [weights] * n, [scale] * n, [gradient] * n))
+        loss = sum(result[0] for result in results) / self.positions
+        if not gradient:
+            return loss, None
+        return loss, sum(result[1] for result in results) / self.positions
+
+    def fit_scale(self, pool: ProcessPoolExecutor, weights: np.ndarray) -> float:
+        """
+        Finds the sigmoid scale that fits the given weights best, searching powers of ten and then refining with a
+        golden section search in log space.
+        """
+        def loss(log_scale):
+            return self.loss(pool, weights, 10 ** log_scale, gradient=False)[0]
+
+        top = -np.log10(max(abs(weights).max(), 1e-12))
+        low = min(np.arange(top - 8, top + 3), key=loss)
+        a, b = low - 1, low + 1
+        ratio = (np.sqrt(5) - 1) / 2
+        for _ in range(30):
+            c, d = b - ratio * (b - a), a + ratio * (b - a)
+            if loss(c) < loss(d):
+                b = d
+            else:
+                a = c
+        return float(10 ** ((a + b) / 2))
+
+    def tune(self, iterations: int = 200, learning_rate: float = 0.05, weights: list = None) -> (list, float, float):
+        """
+        Fits the weights with Adam, on the logarithm of the weights so that they stay positive and weights of very
+        different sizes learn at the same rate. The sigmoid scale is fitted to the starting weights first and then held.
+        :param iterations: gradient steps
+        :param learning_rate: Adam step size in log space
+        :param weights: starting weights for n in 0..k-1. None starts from the default powers of ten
+        :return: tuned weights for n in 0..k-1, loss before tuning, loss after tuning
+        """
+        weights = np.array(PatternTable(self.k, weights).weights[1:], dtype=np.float64)
+        if self.positions == 0 or self.k < 2:
+            return [0] + weights.tolist(), 0.0, 0.0
+
+        with ProcessPoolExecutor(self.workers) as pool:
+            self.scale = self.fit_scale(pool, weights)
+            log_weights = np.log(weights)
+            first = second = np.zeros_like(log_weights)
+            start_loss = self.loss(pool, weights, self.scale, gradient=False)[0]
+            for t in range(1, iterations + 1):
+                loss, gradient = self.loss(pool, np.exp(log_weights), self.scale)
+                gradient = gradient * np.exp(log_weights)
+                first = 0.9 * first + 0.1 * gradient
+                second = 0.999 * second + 0.001 * gradient ** 2
+                log_weights = log_weights - learning_rate * (first / (1 - 0.9 ** t)) / (
+                        np.sqrt(second / (1 - 0.999 ** t)) + 1e-12)
+            weights = np.exp(log_weights)
+            end_loss = self.loss(pool, weights, self.scale, gradient=False)[0]
+        return [0] + weights.tolist(), start_loss, end_loss
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tune pattern weights on self-play positions.")
+    parser.add_argument('directory', help="data directory written by selfplay.py")
+    parser.add_argument('--iterations', type=int, default=200, help="gradient steps")
+    parser.add_argument('--learning-rate', type=float, default=0.05, help="Adam step size")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument('--output', default=minimax_agent.WEIGHTS_FILE, help="weight file to write")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work:
+        tuner = TexelTuner(args.directory, work, args.workers)
+        w, before, after = tuner.tune(args.iterations, args.learning_rate)
+    save_weights(args.output, {tuner.k: w})
+    print(f"Tuned {tuner.positions} positions, loss {round(before, 6)} -> {round(after, 6)}, "
+          f"scale {tuner.scale:.3g}")
+    print(f"Weights for k={tuner.k}: {[round(weight, 3) for weight in w]}, written to {args.output}")
@@ -0,0 +1,295 @@
+"""
+windows.py
+
+Precomputed layout of the windows (runs of k cells that could hold a win) on a board. The layout only depends on the
+board dimensions and k, so it is built once and shared by every state with the same shape.
+"""
+import game
+import operator
+import pickle
+import random
+
+"""Version of the geometry file format written by save_geometry()"""
+GEOMETRY_VERSION = 1
+
+
+class WindowIndex:
+    """
+    Every window on the board as a tuple of flat cell indices, in the same order that GameState.winner() and
+    MinimaxAgent.static_eval() visit them, along with the windows that pass through each cell.
+    Use WindowIndex.of(state) rather than the constructor so that the index is only built once per board shape.
+    """
+    _cache = {}
+
+    def __init__(self, state: game.GameState):
+        """
+        Builds the window index for the shape and k of the given state.
+        :param state: any state with the desired board shape and k
+        """
+        d = state.d
+        self.d = tuple(d)
+        self.k = state.k
+        self.size = d[0] * d[1] * d[2] * d[3]
+
+        windows = []
+        for direction in state.directions:
+            for i in range(d[0]):
+                for j in range(d[1]):
+                    for k in range(d[2]):
+                        for x in range(d[3]):
+                            valid, steps = state.is_valid_starting_point((i, j, k, x), direction)
+                            if valid:
+                                for step in range(steps):
+                                    windows.append(tuple(
+                                        self.index((i + direction[0] * (step + c),
+                                                    j + direction[1] * (step + c),
+                                                    k + direction[2] * (step + c),
+                                                    x + direction[3] * (step + c)))
+                                        for c in range(state.k)))
+        self.windows = windows
+        self.getters = [operator.itemgetter(*window) for window in windows]
+
+        cell_windows = [[] for _ in range(self.size)]
+        for w, window in enumerate(windows):
+            for c in window:
+                cell_windows[c].append(w)
+        self.cell_windows = [tuple(ws) for ws in cell_windows]
+
+    def __getstate__(self):
+        """
+        The itemgetters are left out when pickling and rebuilt from the windows, which is fast.
+        """
+        state = self.__dict__.copy()
+        del state['getters']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.getters = [operator.itemgetter(*window) for window in self.windows]
+
+    @classmethod
+    def of(cls, state: game.GameState) -> "WindowIndex":
+        """
+        Returns the shared window index for the shape and k of the given state, building it on first use.
+        :param state: game state
+        :return: window index
+        """
+        key = (tuple(state.d), state.k)
+        if key not in cls._cache:
+            cls._cache[key] = cls(state)
+        return cls._cache[key]
+
+    def index(self, move: (int, int, int, int)) -> int:
+        """
+        Converts a move (i,j,k,x) to a flat cell index.
+        """
+        d = self.d
+        return ((move[0] * d[1] + move[1]) * d[2] + move[2]) * d[3] + move[3]
+
+    def move(self, index: int) -> (int, int, int, int):
+        """
+        Converts a flat cell index back to a move (i,j,k,x).
+        """
+        d = self.d
+        index, x = divmod(index, d[3])
+        index, k = divmod(index, d[2])
+        i, j = divmod(index, d[1])
+        return i, j, k, x
+
+    def flatten(self, state: game.GameState) -> list:
+        """
+        Lists the pieces of the board in flat cell index order.
+        :param state: game state
+        :return: list of pieces
+        """
+        return [piece for plane in state.board for grid in plane for row in grid for piece in row]
+
+    def winner(self, board: list) -> [str, None]:
+        """
+        Same result as GameState.winner(), looking at each window through its itemgetter instead of walking the board.
+        :param board: flat board from flatten()
+        :return: token of the winning player, 'draw', or None
+        """
+        x_win = (game.X_PIECE,) * self.k
+        o_win = (game.O_PIECE,) * self.k
+        live = False
+        if self.k == 1:
+            contents = [(board[window[0]],) for window in self.windows]
+        else:
+            contents = [getter(board) for getter in self.getters]
+        for window in contents:
+            if window == x_win:
+                return game.X_PIECE
+            elif window == o_win:
+                return game.O_PIECE
+            if not live and game.BLOCK_PIECE not in window and (game.X_PIECE not in window or
+                                                               game.O_PIECE not in window):
+                live = True
+        if not live or game.EMPTY_PIECE not in board:
+            return 'draw'
+        return None
+
+    def open_counts(self, board: list) -> (list, list):
+        """
+        Counts the pieces of each player in every window. A window that holds a piece of the other player or a block can
+        no longer be won by that player, and is counted as -1.
+        :param board: flat board from flatten()
+        :return: X counts, O counts, indexed like windows
+        """
+        x_counts = []
+        o_counts = []
+        for window in self.windows:
+            x_pieces = 0
+            o_pieces = 0
+            blocked = False
+            for c in window:
+                value = board[c]
+                if value == game.X_PIECE:
+                    x_pieces += 1
+                elif value == game.O_PIECE:
+                    o_pieces += 1
+                elif value == game.BLOCK_PIECE:
+                    blocked = True
+            x_counts.append(-1 if blocked or o_pieces else x_pieces)
+            o_counts.append(-1 if blocked or x_pieces else o_pieces)
+        return x_counts, o_counts
+
+    def play_counts(self, x_counts: list, o_counts: list, index: int, piece: str) -> (list, list):
+        """
+        Updates open_counts() for a piece played on an empty square, without counting every window again.
+        :param x_counts: X counts per window before the move
+        :param o_counts: O counts per window before the move
+        :param index: flat cell index of the move
+        :param piece: piece played
+        :return: new X counts, new O counts
+        """
+        x_counts = x_counts.copy()
+        o_counts = o_counts.copy()
+        own, other = (x_counts, o_counts) if piece == game.X_PIECE else (o_counts, x_counts)
+        for w in self.cell_windows[index]:
+            if own[w] >= 0:
+                own[w] += 1
+            other[w] = -1
+        return x_counts, o_counts
+
+
+def zobrist_table(size: int, seed: int = 0) -> list:
+    """
+    Builds a Zobrist hash table from a seeded generator, so that hash keys, and any search that depends on them, are
+    the same on every run.
+    :param size: number of squares on the board
+    :param seed: random seed
+    :return: list with an [X, O] pair of 64 bit keys per square
+    """
+    rng = random.Random(seed)
+    return [[rng.getrandbits(64) for _ in range(2)] for _ in range(size)]
+
+
+def save_geometry(filename: str, state: game.GameState, seed: int = 0):
+    """
+    Writes everything precomputed for a board shape and k to a file: the window index, and the Zobrist table for the
+    given seed. Worker processes can load_geometry() it instead of building both again.
+    :param filename: file to write
+    :param state: any state with the desired board shape and k
+    :param seed: Zobrist table seed
+    """
+    windows = WindowIndex.of(state)
+    with open(filename, 'wb') as file:
+        pickle.dump({'version': GEOMETRY_VERSION, 'windows': windows, 'seed': seed,
+                     'z_table': zobrist_table(windows.size, seed)}, file, pickle.HIGHEST_PROTOCOL)
+
+
+def load_geometry(filename: str) -> (WindowIndex, int, list):
+    """
+    Reads a file written by save_geometry(). The window index is shared through WindowIndex.of() from then on, unless
+    one was already built for the shape, in which case that one is kept.
+    :param filename: file to read
+    :return: window index, Zobrist table seed, Zobrist table
+    """
+    with open(filename, 'rb') as file:
+        data = pickle.load(file)
+    if data.get('version') != GEOMETRY_VERSION:
+        raise ValueError(f"{filename} has geometry version {data.get('version')}, expected {GEOMETRY_VERSION}")
+    windows = data['windows']
+    windows = WindowIndex._cache.setdefault((windows.d, windows.k), windows)
+    return windows, data['seed'], data['z_table']
+
+
+class WindowBoard:
+    """
+    Flat copy of a board that keeps the number of each player's pieces in every window, and a Zobrist key, up to date
+    as moves are played and unplayed. Searches that need to make and unmake many moves build on this rather than on
+    GameState.make_move(), which copies the whole board.
+    """
+
+    def __init__(self, state: game.GameState, z_table: list = None):
+        """
+        :param state: state to copy
+        :param z_table: Zobrist hash table with an [X, O] pair of keys per square. zobrist_table() is used if None
+        """
+        self.windows = WindowIndex.of(state)
+        self.k = state.k
+        self.board = self.windows.flatten(state)
+        self.next_player = state.next_player
+        if z_table is None:
+            z_table = zobrist_table(self.windows.size)
+        self.z_table = z_table
+        self.z_key = 0
+
+        self.empty = self.board.count(game.EMPTY_PIECE)
+        self.blocked = [any(self.board[c] == game.BLOCK_PIECE for c in window) for window in self.windows.windows]
+        self.counts = {game.X_PIECE: [0] * len(self.windows.windows),
+                       game.O_PIECE: [0] * len(self.windows.windows)}
+        for w, window in enumerate(self.windows.windows):
+            for c in window:
+                if self.board[c] in self.counts:
+                    self.counts[self.board[c]][w] += 1
+
+    def play(self, c: int, piece: str):
+        """
+        Places a piece on an empty square and updates the window counts and hash key.
+        """
+        self.board[c] = piece
+        self.empty -= 1
+        counts = self.counts[piece]
+        for w in self.windows.cell_windows[c]:
+            counts[w] += 1
+        self.z_key ^= self.z_table[c][0 if piece == game.X_PIECE else 1]
+
+    def unplay(self, c: int, piece: str):
+        """
+        Removes a piece placed by play().
+        """
+        self.board[c] = game.EMPTY_PIECE
+        self.empty += 1
+        counts = self.counts[piece]
+        for w in self.windows.cell_windows[c]:
+            counts[w] -= 1
+        self.z_key ^= self.z_table[c][0 if piece == game.X_PIECE else 1]
+
+    def completes(self, c: int, piece: str) -> bool:
+        """
+        Checks whether the piece just played on square c completed a window.
+        """
+        counts = self.counts[piece]
+        for w in self.windows.cell_windows[c]:
+            if counts[w] == self.k:
+                return True
+        return False
+
+    def threat_squares(self, piece: str, window_ids) -> set:
+        """
+        Finds the squares where the given player could complete one of the given windows on their next move.
+        :param piece: player to find winning squares for
+        :param window_ids: windows to look at
+        :return: set of flat cell indices
+        """
+        own = self.counts[piece]
+        other = self.counts[game.O_PIECE if piece == game.X_PIECE else game.X_PIECE]
+        squares = set()
+        for w in window_ids:
+            if own[w] == self.k - 1 and other[w] == 0 and not self.blocked[w]:
+                for c in self.windows.windows[w]:
+                    if self.board[c] == game.EMPTY_PIECE:
+                        squares.add(c)
+        return squares